@@ -2,17 +2,45 @@
 ACE Framework - Agentic Context Engineering
 Functional implementation following ICLR 2026 paper
 """
+import asyncio
+import time
+from datetime import datetime
 from typing import List, Tuple
 from ace_types import (
     Result, Success, Failure, ContextState, Trajectory, Insight, 
     DeltaUpdate, ContextBullet, OllamaConfig
 )
 from functional_core import (
-    get_relevant_bullets, parse_trajectory_response, parse_insights_response,
+    get_relevant_bullets, parse_trajectory_response, parse_insights_response, fused_insight_text,
     insights_to_delta, merge_delta, prune_low_quality_bullets, 
-    limit_context_size, build_context_prompt, update_bullet_feedback
+    limit_context_size, build_context_prompt, apply_feedback, empty_mapping
 )
-from imperative_shell import OllamaClient, bind, map_result, log_success, log_error
+from imperative_shell import (
+    OllamaClient, EmbeddingCache, create_embedding_cache, bind, map_result,
+    log_success, log_error, log_warning
+)
+
+# Stream batching: first chunk ships immediately, later ones coalesce
+_STREAM_FLUSH_CHARS = 32
+_STREAM_FLUSH_SECONDS = 0.01
+
+# Prompt templates: static parts are built once, requests only concatenate
+_TRAJECTORY_TAIL = """
+
+Provide a brief answer in this format:
+STEPS: [step1; step2; step3]
+OUTCOME: your answer here
+SUCCESS: true
+USED_BULLETS: []"""
+_INSIGHT_BLOCK = "[Content: key learning from this task; Type: strategy; Confidence: 0.8]"
+_FUSED_TAIL = _TRAJECTORY_TAIL + "\n\nThen provide one key insight:\n" + _INSIGHT_BLOCK
+_REFLECT_HEAD = "Based on this task: "
+_REFLECT_MID = "\nResult: "
+_REFLECT_TAIL = "\n\nProvide one key insight:\n" + _INSIGHT_BLOCK
+_CONTINUE_TAIL = "\n\nContinue from where you stopped. Do not repeat, just continue:"
+_CONVERSATION_HEAD = "Previous conversation:\n"
+_CONVERSATION_MID = "\n\nNew query: "
+_CONVERSATION_TAIL = "\n\nAnswer:"
 
 class ACEGenerator:
     """Generator: Produces reasoning trajectories (pure + I/O)"""
@@ -29,16 +57,26 @@ class ACEGenerator:
         bullets = get_relevant_bullets(context, query)
         context_text = build_context_prompt(bullets)
         
-        prompt = f"""{query}
-
-Provide a brief answer in this format:
-STEPS: [step1; step2; step3]
-OUTCOME: your answer here
-SUCCESS: true
-USED_BULLETS: []"""
+        prompt = query + _TRAJECTORY_TAIL
         
         result = await self.client.generate(prompt)
         return map_result(result, lambda r: parse_trajectory_response(query, r))
+    
+    async def fused_generate_and_reflect(
+        self,
+        query: str
+    ) -> Result[Tuple[Trajectory, List[Insight]], str]:
+        """Generate trajectory and insight in a single LLM call"""
+        prompt = query + _FUSED_TAIL
+        
+        result = await self.client.generate(prompt)
+        return map_result(
+            result,
+            lambda r: (
+                parse_trajectory_response(query, r),
+                parse_insights_response(fused_insight_text(r), query)
+            )
+        )
 
 class ACEReflector:
     """Reflector: Distills insights from trajectories"""
@@ -51,12 +89,9 @@ class ACEReflector:
         trajectory: Trajectory
     ) -> Result[List[Insight], str]:
         """Reflect on trajectory and extract insights"""
-        steps_text = '; '.join(s.description for s in trajectory.steps[:3])
-        prompt = f"""Based on this task: {trajectory.query}
-Result: {trajectory.outcome}
-
-Provide one key insight:
-[Content: key learning from this task; Type: strategy; Confidence: 0.8]"""
+        prompt = "".join((
+            _REFLECT_HEAD, trajectory.query, _REFLECT_MID, trajectory.outcome, _REFLECT_TAIL
+        ))
         
         result = await self.client.generate(prompt)
         return map_result(
@@ -68,7 +103,7 @@ class ACECurator:
     """Curator: Integrates insights into context"""
     
     def __init__(self):
-        self.context = ContextState(bullets={})
+        self.context = ContextState(bullets=empty_mapping(), postings=empty_mapping())
     
     def create_delta(self, insights: List[Insight]) -> DeltaUpdate:
         """Create delta update from insights"""
@@ -81,17 +116,7 @@ class ACECurator:
     
     def update_feedback(self, bullet_ids: List[str], success: bool) -> None:
         """Update bullet feedback"""
-        new_bullets = dict(self.context.bullets)
-        for bullet_id in bullet_ids:
-            if bullet_id in new_bullets:
-                new_bullets[bullet_id] = update_bullet_feedback(
-                    new_bullets[bullet_id],
-                    success
-                )
-        self.context = ContextState(
-            bullets=new_bullets,
-            version=self.context.version + 1
-        )
+        self.context = apply_feedback(self.context, bullet_ids, success)
     
     def grow_and_refine(self, max_size: int = 1000) -> ContextState:
         """Apply grow-and-refine mechanism"""
@@ -112,75 +137,125 @@ class ACEFramework:
         self.generator = ACEGenerator(self.client)
         self.reflector = ACEReflector(self.client)
         self.curator = ACECurator()
+        self.cache: EmbeddingCache | None = None
+        self._insight_index: EmbeddingCache | None = None
+        self._stats_memo: Tuple[int, dict] | None = None
+        self._conv_memo: Tuple[int, Tuple[str, str] | None] | None = None
     
     async def initialize(self) -> Result[bool, str]:
         """Initialize framework"""
         result = await self.client.initialize()
-        match result:
-            case Success(_):
-                log_success("ACE Framework initialized")
-                return Success(True)
-            case Failure(error):
-                log_error(f"Initialization failed: {error}")
-                return Failure(error)
+        if isinstance(result, Failure):
+            log_error(f"Initialization failed: {result.error}")
+            return Failure(result.error)
+        
+        # Model load on the server overlaps the local embedding model load
+        warmup_task = asyncio.create_task(self.client.warmup()) if self.config.warmup else None
+        
+        if self.config.semantic_cache:
+            cache_result = await asyncio.to_thread(create_embedding_cache, self.config)
+            if isinstance(cache_result, Success):
+                cache = cache_result.value
+                self.cache = cache
+                # Queries whose reflection was already absorbed (shares the model)
+                self._insight_index = EmbeddingCache(
+                    threshold=self.config.reflect_skip_threshold,
+                    max_size=self.config.semantic_cache_size,
+                    model=cache.model
+                )
+            else:
+                log_warning(cache_result.error)
+        
+        if warmup_task is not None:
+            warmup_result = await warmup_task
+            if isinstance(warmup_result, Failure):
+                log_warning(f"Model warmup skipped: {warmup_result.error}")
+        log_success("ACE Framework initialized")
+        return Success(True)
+    
+    def _recent_conversation(self) -> Tuple[str, str] | None:
+        """Latest conversation bullet as (content, rendered context text)"""
+        context = self.curator.get_context()
+        if self._conv_memo is None or self._conv_memo[0] != context.version:
+            latest = max(
+                (b for b in context.bullets.values() if "conversation" in b.tags),
+                key=lambda b: b.created_ts,
+                default=None
+            )
+            rendered = None if latest is None else (latest.content, build_context_prompt([latest]))
+            self._conv_memo = (context.version, rendered)
+        return self._conv_memo[1]
     
     async def process_query_stream(self, query: str):
         """Process query with streaming response"""
-        context = self.curator.get_context()
+        # Get most recent conversation bullet (memoized per context version)
+        recent_conv = self._recent_conversation()
         
-        # Get recent conversation bullets
-        conv_bullets = [b for b in context.bullets.values() if "conversation" in b.tags]
-        conv_bullets.sort(key=lambda x: x.created_at, reverse=True)
-        recent_conv = conv_bullets[:1]
-        
-        is_continue = query.strip().lower() in ['continue', 'tiếp tục']
+        is_continue = query.strip().lower() in ('continue', 'tiếp tục')
         
         if is_continue and recent_conv:
-            last_conv = recent_conv[0].content
-            prompt = f"""{last_conv}
-
-Continue from where you stopped. Do not repeat, just continue:"""
+            last_conv, _ = recent_conv
+            prompt = last_conv + _CONTINUE_TAIL
         elif recent_conv:
-            context_text = build_context_prompt(recent_conv)
-            prompt = f"""Previous conversation:
-{context_text}
-
-New query: {query}
-
-Answer:"""
+            _, context_text = recent_conv
+            prompt = "".join((
+                _CONVERSATION_HEAD, context_text, _CONVERSATION_MID, query, _CONVERSATION_TAIL
+            ))
         else:
             prompt = query
         
         full_response = ""
-        async for result in self.client.generate_stream(prompt):
-            match result:
-                case Success(chunk):
-                    full_response += chunk
-                    yield chunk
-                case Failure(error):
-                    yield f"\n❌ Error: {error}"
+        vec_task: asyncio.Task | None = None
+        if self.cache is not None:
+            vec_task = asyncio.create_task(asyncio.to_thread(self.cache.embed, query))
+        try:
+            pending: List[str] = []
+            pending_chars = 0
+            last_flush = 0.0
+            async for result in self.client.generate_stream(prompt):
+                if not isinstance(result, Success):
+                    if pending:
+                        yield "".join(pending)
+                    yield f"\n❌ Error: {result.error}"
                     return
-        
-        # Parse and learn from response
-        trajectory = parse_trajectory_response(query, full_response)
-        
-        # Always save full query-response pair as context
-        from functional_core import create_bullet
-        query_bullet = create_bullet(f"Q: {query}\nA: {full_response}", ["conversation"])
-        from ace_types import DeltaUpdate
-        from datetime import datetime
-        conv_delta = DeltaUpdate(bullets=(query_bullet,), timestamp=datetime.now())
-        self.curator.apply_delta(conv_delta)
-        
-        insights_result = await self.reflector.reflect(trajectory)
-        
-        match insights_result:
-            case Success(insights):
+                chunk = result.value
+                full_response += chunk
+                pending.append(chunk)
+                pending_chars += len(chunk)
+                now = time.monotonic()
+                if pending_chars >= _STREAM_FLUSH_CHARS or now - last_flush >= _STREAM_FLUSH_SECONDS:
+                    yield "".join(pending)
+                    pending.clear()
+                    pending_chars = 0
+                    last_flush = now
+            if pending:
+                yield "".join(pending)
+            
+            # Parse and learn from response
+            trajectory = parse_trajectory_response(query, full_response)
+            
+            # Always save full query-response pair as context
+            from functional_core import create_bullet
+            query_bullet = create_bullet(f"Q: {query}\nA: {full_response}", ["conversation"])
+            from ace_types import DeltaUpdate
+            conv_delta = DeltaUpdate(bullets=(query_bullet,), timestamp=datetime.now())
+            self.curator.apply_delta(conv_delta)
+            
+            query_vec = await vec_task if vec_task is not None else None
+            if self._needs_reflection(trajectory, query_vec):
+                insights_result = await self.reflector.reflect(trajectory)
+            else:
+                insights_result = Success([])
+            
+            if isinstance(insights_result, Success):
+                insights = insights_result.value
+                self._mark_absorbed(query_vec, insights)
                 delta = self.curator.create_delta(insights)
                 self.curator.apply_delta(delta)
                 self.curator.update_feedback(list(trajectory.used_bullets), trajectory.success)
-            case Failure(_):
-                pass
+        finally:
+            if vec_task is not None and not vec_task.done():
+                vec_task.cancel()
     
     async def process_query(
         self,
@@ -188,17 +263,54 @@ Answer:"""
         feedback: str | None = None
     ) -> Result[Tuple[str, DeltaUpdate], str]:
         """Process query through ACE pipeline"""
-        # Step 1: Generate trajectory
-        traj_result = await self.generator.generate_trajectory(
-            query,
-            self.curator.get_context()
-        )
+        # Step 0: Semantic cache lookup (paraphrases skip Generator and Reflector)
+        query_vec = None
+        if self.cache is not None and feedback is None:
+            query_vec = await asyncio.to_thread(self.cache.embed, query)
+            cached = self.cache.lookup(query_vec)
+            if cached is not None:
+                return Success(cached)
         
-        match traj_result:
-            case Failure(error):
-                return Failure(f"Generation failed: {error}")
-            case Success(trajectory):
-                pass
+        routine = not self._needs_reflection(None, query_vec)
+        result = await self._run_pipeline(query, feedback, routine=routine)
+        if isinstance(result, Failure):
+            return Failure(result.error)
+        trajectory, insights = result.value
+        
+        response, delta = self._commit(trajectory, insights)
+        self._mark_absorbed(query_vec, insights)
+        
+        if query_vec is not None and self.cache is not None:
+            self.cache.insert(query_vec, (response, delta))
+        
+        return Success((response, delta))
+    
+    async def _run_pipeline(
+        self,
+        query: str,
+        feedback: str | None = None,
+        routine: bool = False
+    ) -> Result[Tuple[Trajectory, List[Insight]], str]:
+        """Run Generator and Reflector (I/O only, no curator mutation)"""
+        trajectory: Trajectory
+        insights: List[Insight]
+        if routine:
+            # Step 1 only: similar insight already absorbed, reflect just on failure
+            generated = await self.generator.generate_trajectory(query, self.curator.get_context())
+            if isinstance(generated, Failure):
+                return Failure(f"Generation failed: {generated.error}")
+            trajectory, insights = generated.value, []
+            if not trajectory.success:
+                reflected = await self.reflector.reflect(trajectory)
+                if isinstance(reflected, Failure):
+                    return Failure(f"Reflection failed: {reflected.error}")
+                insights = reflected.value
+        else:
+            # Steps 1-2: Generate trajectory and reflect in one round-trip
+            fused = await self.generator.fused_generate_and_reflect(query)
+            if isinstance(fused, Failure):
+                return Failure(f"Generation failed: {fused.error}")
+            trajectory, insights = fused.value
         
         # Add feedback if provided
         if feedback:
@@ -211,15 +323,27 @@ Answer:"""
                 feedback=feedback
             )
         
-        # Step 2: Reflect on trajectory
-        insights_result = await self.reflector.reflect(trajectory)
-        
-        match insights_result:
-            case Failure(error):
-                return Failure(f"Reflection failed: {error}")
-            case Success(insights):
-                pass
-        
+        return Success((trajectory, insights))
+    
+    def _needs_reflection(self, trajectory: Trajectory | None, query_vec) -> bool:
+        """Skip reflection only for successful queries close to an absorbed insight"""
+        if self.config.always_reflect or query_vec is None or self._insight_index is None:
+            return True
+        if trajectory is not None and not trajectory.success:
+            return True
+        return self._insight_index.lookup(query_vec) is None
+    
+    def _mark_absorbed(self, query_vec, insights: List[Insight]) -> None:
+        """Remember that a query's insights are in context, so similar queries skip reflection"""
+        if insights and query_vec is not None and self._insight_index is not None:
+            self._insight_index.insert(query_vec, True)
+    
+    def _commit(
+        self,
+        trajectory: Trajectory,
+        insights: List[Insight]
+    ) -> Tuple[str, DeltaUpdate]:
+        """Apply insights to curator and build response"""
         # Step 3: Create and apply delta
         delta = self.curator.create_delta(insights)
         self.curator.apply_delta(delta)
@@ -235,33 +359,46 @@ Outcome: {trajectory.outcome}
 Success: {trajectory.success}
 New insights: {len(delta.bullets)}"""
         
-        return Success((response, delta))
+        return response, delta
     
     async def adaptive_learning(
         self,
         queries: List[str],
-        max_iterations: int = 3
+        max_iterations: int = 3,
+        max_concurrent: int = 8
     ) -> Result[dict, str]:
         """Run adaptive learning cycle"""
         results = {"iterations": [], "context_stats": []}
+        sem = asyncio.Semaphore(max_concurrent)
+        
+        async def _run(query: str):
+            async with sem:
+                return await self._run_pipeline(query)
         
         for iteration in range(max_iterations):
             iteration_results = []
             
-            for query in queries:
-                result = await self.process_query(query)
-                match result:
-                    case Success((response, delta)):
-                        iteration_results.append({
-                            "query": query,
-                            "response": response,
-                            "new_bullets": len(delta.bullets)
-                        })
-                    case Failure(error):
-                        iteration_results.append({
-                            "query": query,
-                            "error": error
-                        })
+            # Overlap LLM calls across queries; curator updates stay serialized below
+            pipeline_results = await asyncio.gather(
+                *[_run(query) for query in queries],
+                return_exceptions=True
+            )
+            
+            for query, result in zip(queries, pipeline_results):
+                if isinstance(result, BaseException):
+                    result = Failure(f"Pipeline failed: {str(result)}")
+                if isinstance(result, Success):
+                    response, delta = self._commit(*result.value)
+                    iteration_results.append({
+                        "query": query,
+                        "response": response,
+                        "new_bullets": len(delta.bullets)
+                    })
+                else:
+                    iteration_results.append({
+                        "query": query,
+                        "error": result.error
+                    })
             
             # Apply grow-and-refine
             self.curator.grow_and_refine()
@@ -281,20 +418,19 @@ New insights: {len(delta.bullets)}"""
     def get_context_stats(self) -> dict:
         """Get context statistics"""
         context = self.curator.get_context()
-        helpful = sum(
-            1 for b in context.bullets.values()
-            if b.helpful_count > b.harmful_count
-        )
+        # Context versions only grow, so an unchanged version means unchanged stats
+        if self._stats_memo is not None and self._stats_memo[0] == context.version:
+            return self._stats_memo[1]
         
-        return {
+        # Aggregates are maintained incrementally by the curator's updates
+        stats = {
             "total_bullets": len(context.bullets),
-            "helpful_bullets": helpful,
+            "helpful_bullets": context.helpful_count_bullets,
             "version": context.version,
-            "avg_helpfulness": (
-                sum(b.helpful_count for b in context.bullets.values()) / 
-                max(len(context.bullets), 1)
-            )
+            "avg_helpfulness": context.helpful_total / max(len(context.bullets), 1)
         }
+        self._stats_memo = (context.version, stats)
+        return stats
     
     async def shutdown(self) -> Result[None, str]:
         """Shutdown framework"""
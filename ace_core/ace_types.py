@@ -3,9 +3,10 @@ ACE Types - Functional Type Definitions
 Railway-Oriented Programming with Result types
 """
 from dataclasses import dataclass, field
-from typing import TypeVar, Generic, Callable, List, Optional, Dict, Any
+from typing import TypeVar, Generic, Callable, ClassVar, List, Optional, Dict, Mapping, Any
 from datetime import datetime
 from enum import Enum
+import sys
 
 # Generic types
 T = TypeVar('T')
@@ -15,10 +16,13 @@ E = TypeVar('E')
 @dataclass(frozen=True)
 class Success(Generic[T]):
     value: T
+    # Class-level flag: branching on it skips an isinstance check
+    is_ok: ClassVar[bool] = True
 
 @dataclass(frozen=True)
 class Failure(Generic[E]):
     error: E
+    is_ok: ClassVar[bool] = False
 
 Result = Success[T] | Failure[E]
 
@@ -31,7 +35,25 @@ class ContextBullet:
     helpful_count: int = 0
     harmful_count: int = 0
     created_at: datetime = field(default_factory=datetime.now)
-    tags: List[str] = field(default_factory=list)
+    tags: tuple[str, ...] = ()
+    word_set: frozenset[str] = field(default_factory=frozenset, compare=False, repr=False)
+    created_ts: float = field(init=False, compare=False, repr=False)
+    signature: int = field(init=False, compare=False, repr=False)
+    
+    def __post_init__(self):
+        # Bullets built directly (not via create_bullet) get their word set here;
+        # same tokenization as functional_core.tokenize
+        if not self.word_set:
+            object.__setattr__(
+                self, 'word_set', frozenset(map(sys.intern, self.content.lower().split()))
+            )
+        # Cache POSIX timestamp so age checks avoid per-bullet timedelta allocation
+        object.__setattr__(self, 'created_ts', self.created_at.timestamp())
+        # 64-bit Bloom signature of word_set for cheap duplicate prefiltering
+        signature = 0
+        for word in self.word_set:
+            signature |= 1 << (hash(word) & 63)
+        object.__setattr__(self, 'signature', signature)
 
 @dataclass(frozen=True)
 class ReasoningStep:
@@ -72,8 +94,36 @@ class DeltaUpdate:
 @dataclass(frozen=True)
 class ContextState:
     """Immutable context state"""
-    bullets: Dict[str, ContextBullet]
+    bullets: Mapping[str, ContextBullet]
     version: int = 0
+    # Derived in __post_init__ when not supplied, never None afterwards
+    postings: Mapping[str, frozenset[str]] = field(default=None, compare=False, repr=False)  # type: ignore[arg-type]
+    # Running feedback aggregates, maintained by the mutation paths
+    helpful_total: int = field(default=None, compare=False)  # type: ignore[assignment]
+    harmful_total: int = field(default=None, compare=False)  # type: ignore[assignment]
+    helpful_count_bullets: int = field(default=None, compare=False)  # type: ignore[assignment]
+    
+    def __post_init__(self):
+        # Derive aggregates with one scan when the caller did not maintain them
+        if self.helpful_total is None or self.harmful_total is None or self.helpful_count_bullets is None:
+            helpful = harmful = helpful_bullets = 0
+            for bullet in self.bullets.values():
+                helpful += bullet.helpful_count
+                harmful += bullet.harmful_count
+                helpful_bullets += bullet.helpful_count > bullet.harmful_count
+            object.__setattr__(self, 'helpful_total', helpful)
+            object.__setattr__(self, 'harmful_total', harmful)
+            object.__setattr__(self, 'helpful_count_bullets', helpful_bullets)
+        
+        # Derive token -> bullet ids index when the caller did not maintain it
+        if self.postings is None:
+            postings: Dict[str, set] = {}
+            for bullet_id, bullet in self.bullets.items():
+                for word in bullet.word_set:
+                    postings.setdefault(word, set()).add(bullet_id)
+            object.__setattr__(
+                self, 'postings', {word: frozenset(ids) for word, ids in postings.items()}
+            )
 
 @dataclass(frozen=True)
 class OllamaConfig:
@@ -83,3 +133,16 @@ class OllamaConfig:
     temperature: float = 0.7
     max_tokens: int = 1024
     context_window: int = 4096
+    # Opt-in: needs requirements-semantic.txt and loads an embedding model at startup
+    semantic_cache: bool = False
+    semantic_cache_size: int = 256
+    semantic_cache_threshold: float = 0.87
+    embedding_model: str = "all-MiniLM-L6-v2"
+    always_reflect: bool = False
+    reflect_skip_threshold: float = 0.75
+    # Keep-alive pool size; match the server's OLLAMA_NUM_PARALLEL fan-out
+    max_connections: int = 64
+    # Load the model during initialize so the first query skips the cold start
+    warmup: bool = True
+    # Concurrent generate requests; None uses OLLAMA_NUM_PARALLEL (default 4)
+    num_parallel: Optional[int] = None
@@ -2,19 +2,55 @@
 ACE Functional Core - Pure Functions
 All business logic without side effects
 """
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterable, Mapping, AbstractSet, Any
 from datetime import datetime, timedelta
+from collections import Counter
+from itertools import chain
+import heapq
 import re
+import sys
 import uuid
 from ace_types import Success, Failure, Result, ContextBullet, Trajectory, Insight, DeltaUpdate, ContextState, ReasoningStep
 
+try:
+    from immutables import Map as PersistentMap
+    HAS_PERSISTENT_MAP = True
+except ImportError:  # Fall back to copy-on-write dicts
+    HAS_PERSISTENT_MAP = False
+
+SECONDS_PER_DAY = 86400.0
+
+# Mapping helpers: structural sharing with immutables.Map, full copy with dict
+def empty_mapping() -> Any:
+    """Empty bullets/postings mapping (persistent when available)"""
+    return PersistentMap() if HAS_PERSISTENT_MAP else {}
+
+def is_persistent(mapping: Mapping) -> bool:
+    """Check whether mapping supports structural-sharing updates"""
+    return HAS_PERSISTENT_MAP and isinstance(mapping, PersistentMap)
+
+def begin_update(mapping: Mapping) -> Any:
+    """Start a batch of updates on a mapping"""
+    if is_persistent(mapping):
+        return mapping.mutate()  # type: ignore[attr-defined]
+    return dict(mapping)
+
+def finish_update(mutation: Any) -> Any:
+    """Seal a batch of updates started with begin_update"""
+    return mutation if isinstance(mutation, dict) else mutation.finish()
+
 # Pure functions for context operations
-def create_bullet(content: str, tags: List[str] = None) -> ContextBullet:
+def tokenize(text: str) -> frozenset[str]:
+    """Lowercase interned word set used for relevance and duplicate checks"""
+    return frozenset(map(sys.intern, text.lower().split()))
+
+def create_bullet(content: str, tags: Optional[List[str]] = None) -> ContextBullet:
     """Create new context bullet"""
     return ContextBullet(
         id=str(uuid.uuid4()),
         content=content,
-        tags=tuple(tags or [])
+        tags=tuple(tags or []),
+        word_set=tokenize(content)
     )
 
 def update_bullet_feedback(bullet: ContextBullet, helpful: bool) -> ContextBullet:
@@ -25,13 +61,13 @@ def update_bullet_feedback(bullet: ContextBullet, helpful: bool) -> ContextBulle
         helpful_count=bullet.helpful_count + (1 if helpful else 0),
         harmful_count=bullet.harmful_count + (0 if helpful else 1),
         created_at=bullet.created_at,
-        tags=bullet.tags
+        tags=bullet.tags,
+        word_set=bullet.word_set
     )
 
-def score_bullet(bullet: ContextBullet, query_words: set) -> float:
+def score_bullet(bullet: ContextBullet, query_words: AbstractSet[str]) -> float:
     """Score bullet relevance to query"""
-    bullet_words = set(bullet.content.lower().split())
-    overlap = len(query_words.intersection(bullet_words))
+    overlap = len(query_words & bullet.word_set)
     feedback_score = (bullet.helpful_count - bullet.harmful_count) * 0.1
     return overlap + feedback_score
 
@@ -44,52 +80,172 @@ def get_relevant_bullets(
     if not context.bullets:
         return []
     
-    query_words = set(query.lower().split())
-    scored = [(score_bullet(b, query_words), b) for b in context.bullets.values()]
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [b for score, b in scored[:max_bullets] if score > 0]
+    query_words = tokenize(query)
+    # Sparse (bullet x token) @ query product over the postings index:
+    # each bullet's overlap is the number of query tokens whose posting holds it
+    overlaps = Counter(chain.from_iterable(context.postings.get(w, ()) for w in query_words))
+    bullets = context.bullets
+    scored = [
+        (overlap + (b.helpful_count - b.harmful_count) * 0.1, b)
+        for bid, overlap in overlaps.items()
+        for b in (bullets[bid],)
+    ]
+    # Ties go to the older bullet, independent of postings/map iteration order
+    top = heapq.nlargest(max_bullets, scored, key=lambda x: (x[0], -x[1].created_ts))
+    return [b for score, b in top if score > 0]
+
+def _is_similar(new_bullet: ContextBullet, existing_bullet: ContextBullet, threshold: float) -> bool:
+    """Share at least threshold of new_bullet's words with existing_bullet"""
+    new_words = new_bullet.word_set
+    existing_words = existing_bullet.word_set
+    if not new_words or not existing_words:
+        return False
+    # Signature bits missing from the existing bullet each stand for >= 1 non-shared word
+    missing = (new_bullet.signature & ~existing_bullet.signature).bit_count()
+    if len(new_words) - missing < threshold * len(new_words):
+        return False
+    return len(new_words & existing_words) / len(new_words) >= threshold
 
 def find_duplicate_bullet(
     new_bullet: ContextBullet,
-    existing: Dict[str, ContextBullet],
-    threshold: float = 0.7
+    existing: Mapping[str, ContextBullet],
+    threshold: float = 0.7,
+    postings: Optional[Mapping[str, frozenset[str]]] = None
 ) -> Optional[str]:
     """Find duplicate bullet by content similarity"""
-    new_words = set(new_bullet.content.lower().split())
+    new_words = new_bullet.word_set
     
-    for bullet_id, existing_bullet in existing.items():
-        existing_words = set(existing_bullet.content.lower().split())
-        if not new_words or not existing_words:
-            continue
-        overlap = len(new_words.intersection(existing_words))
-        similarity = overlap / len(new_words)
-        if similarity >= threshold:
-            return bullet_id
-    return None
+    if postings is None:
+        return next((bid for bid, b in existing.items() if _is_similar(new_bullet, b, threshold)), None)
+    
+    # Postings give an unordered candidate set: return the earliest created match
+    # so the result does not depend on set iteration order
+    candidates = set().union(*(postings.get(w, ()) for w in new_words))
+    matches = [bid for bid in candidates if _is_similar(new_bullet, existing[bid], threshold)]
+    if not matches:
+        return None
+    return min(matches, key=lambda bid: (existing[bid].created_ts, bid))
+
+def shift_totals(
+    totals: Tuple[int, int, int],
+    removed: Iterable[ContextBullet] = (),
+    added: Iterable[ContextBullet] = ()
+) -> Tuple[int, int, int]:
+    """Adjust (helpful, harmful, helpful bullets) aggregates for replaced bullets"""
+    helpful, harmful, helpful_bullets = totals
+    for bullet in removed:
+        helpful -= bullet.helpful_count
+        harmful -= bullet.harmful_count
+        helpful_bullets -= bullet.helpful_count > bullet.harmful_count
+    for bullet in added:
+        helpful += bullet.helpful_count
+        harmful += bullet.harmful_count
+        helpful_bullets += bullet.helpful_count > bullet.harmful_count
+    return helpful, harmful, helpful_bullets
+
+def context_totals(context: ContextState) -> Tuple[int, int, int]:
+    """Current (helpful, harmful, helpful bullets) aggregates of context"""
+    return context.helpful_total, context.harmful_total, context.helpful_count_bullets
 
 def merge_delta(
     context: ContextState,
     delta: DeltaUpdate
 ) -> ContextState:
     """Merge delta update into context (pure function)"""
-    new_bullets = dict(context.bullets)
+    new_bullets = begin_update(context.bullets)
+    new_postings = begin_update(context.postings)
+    totals = context_totals(context)
     
     for bullet in delta.bullets:
-        duplicate_id = find_duplicate_bullet(bullet, new_bullets)
+        duplicate_id = find_duplicate_bullet(bullet, new_bullets, postings=new_postings)
         if duplicate_id:
             existing = new_bullets[duplicate_id]
-            new_bullets[duplicate_id] = update_bullet_feedback(existing, True)
+            updated = update_bullet_feedback(existing, True)
+            new_bullets[duplicate_id] = updated
+            totals = shift_totals(totals, (existing,), (updated,))
         else:
             new_bullets[bullet.id] = bullet
+            totals = shift_totals(totals, added=(bullet,))
+            for word in bullet.word_set:
+                new_postings[word] = new_postings.get(word, frozenset()) | {bullet.id}
     
-    return ContextState(bullets=new_bullets, version=context.version + 1)
+    return ContextState(
+        bullets=finish_update(new_bullets),
+        version=context.version + 1,
+        postings=finish_update(new_postings),
+        helpful_total=totals[0],
+        harmful_total=totals[1],
+        helpful_count_bullets=totals[2]
+    )
+
+def apply_feedback(
+    context: ContextState,
+    bullet_ids: List[str],
+    success: bool
+) -> ContextState:
+    """Update feedback of used bullets (pure function)"""
+    new_bullets = begin_update(context.bullets)
+    totals = context_totals(context)
+    for bullet_id in bullet_ids:
+        if bullet_id in new_bullets:
+            existing = new_bullets[bullet_id]
+            updated = update_bullet_feedback(existing, success)
+            new_bullets[bullet_id] = updated
+            totals = shift_totals(totals, (existing,), (updated,))
+    
+    return ContextState(
+        bullets=finish_update(new_bullets),
+        version=context.version + 1,
+        postings=context.postings,
+        helpful_total=totals[0],
+        harmful_total=totals[1],
+        helpful_count_bullets=totals[2]
+    )
+
+def drop_postings(
+    postings: Mapping[str, frozenset[str]],
+    dropped: Iterable[Tuple[str, ContextBullet]]
+) -> Mapping[str, frozenset[str]]:
+    """Remove dropped (mapping key, bullet) pairs from postings index (returns new index)"""
+    # Postings hold bullets-mapping keys, which need not equal bullet.id
+    removed: Dict[str, set] = {}
+    for bullet_id, bullet in dropped:
+        for word in bullet.word_set:
+            removed.setdefault(word, set()).add(bullet_id)
+    
+    new_postings = begin_update(postings)
+    for word, ids in removed.items():
+        remaining = new_postings.get(word, frozenset()) - ids
+        if remaining:
+            new_postings[word] = remaining
+        elif word in new_postings:
+            del new_postings[word]
+    return finish_update(new_postings)
+
+def select_bullets(
+    context: ContextState,
+    keep_ids: Iterable[str]
+) -> ContextState:
+    """Keep only the given bullet ids (returns new context)"""
+    kept = {bullet_id: context.bullets[bullet_id] for bullet_id in keep_ids}
+    dropped = [(bullet_id, b) for bullet_id, b in context.bullets.items() if bullet_id not in kept]
+    new_bullets: Mapping[str, ContextBullet] = PersistentMap(kept) if is_persistent(context.bullets) else kept
+    totals = shift_totals(context_totals(context), removed=(b for _, b in dropped))
+    return ContextState(
+        bullets=new_bullets,
+        version=context.version + 1,
+        postings=drop_postings(context.postings, dropped),
+        helpful_total=totals[0],
+        harmful_total=totals[1],
+        helpful_count_bullets=totals[2]
+    )
 
 def prune_low_quality_bullets(
     context: ContextState,
     min_days_old: int = 30
 ) -> ContextState:
     """Remove low-quality bullets"""
-    now = datetime.now()
+    now_ts = datetime.now().timestamp()
     filtered = {}
     
     for bullet_id, bullet in context.bullets.items():
@@ -98,11 +254,11 @@ def prune_low_quality_bullets(
             filtered[bullet_id] = bullet
         # Keep if neutral but recent
         elif bullet.helpful_count == bullet.harmful_count == 0:
-            days_old = (now - bullet.created_at).days
+            days_old = (now_ts - bullet.created_ts) // SECONDS_PER_DAY
             if days_old <= min_days_old:
                 filtered[bullet_id] = bullet
     
-    return ContextState(bullets=filtered, version=context.version + 1)
+    return select_bullets(context, filtered)
 
 def limit_context_size(
     context: ContextState,
@@ -112,25 +268,48 @@ def limit_context_size(
     if len(context.bullets) <= max_size:
         return context
     
-    now = datetime.now()
+    now_ts = datetime.now().timestamp()
     scored = []
     for bullet_id, bullet in context.bullets.items():
         score = bullet.helpful_count - bullet.harmful_count
-        days_old = (now - bullet.created_at).days
+        days_old = (now_ts - bullet.created_ts) // SECONDS_PER_DAY
         recency_bonus = max(0, 7 - days_old) * 0.1
         scored.append((score + recency_bonus, bullet_id, bullet))
     
-    scored.sort(key=lambda x: x[0], reverse=True)
-    top_bullets = {bullet_id: bullet for _, bullet_id, bullet in scored[:max_size]}
-    
-    return ContextState(bullets=top_bullets, version=context.version + 1)
+    # Ties go to the older bullet: immutables.Map iterates in hash order, not insertion order
+    top = heapq.nlargest(max_size, scored, key=lambda x: (x[0], -x[2].created_ts))
+    return select_bullets(context, (bullet_id for _, bullet_id, _ in top))
+
+# Precompiled trajectory field patterns
+_FIELD_KEY_RE = re.compile(r'STEPS:|OUTCOME:|SUCCESS:|USED_BULLETS:', re.IGNORECASE)
+_FIELD_RES = {
+    'STEPS': re.compile(r'STEPS:\s*\[(.*?)\]', re.DOTALL | re.IGNORECASE),
+    'OUTCOME': re.compile(r'OUTCOME:\s*(.+?)(?=\n|$)', re.DOTALL | re.IGNORECASE),
+    'SUCCESS': re.compile(r'SUCCESS:\s*(true|false)', re.IGNORECASE),
+    'USED_BULLETS': re.compile(r'USED_BULLETS:\s*\[(.*?)\]', re.IGNORECASE),
+}
+
+def extract_trajectory_fields(response: str) -> Dict[str, str]:
+    """Extract first complete match of each trajectory field in one scan"""
+    fields: Dict[str, str] = {}
+    for key_match in _FIELD_KEY_RE.finditer(response):
+        key = key_match.group()[:-1].upper()
+        if key in fields:
+            continue
+        match = _FIELD_RES[key].match(response, key_match.start())
+        if match:
+            fields[key] = match.group(1)
+            if len(fields) == len(_FIELD_RES):
+                break
+    return fields
 
 def parse_trajectory_response(query: str, response: str) -> Trajectory:
     """Parse LLM response into trajectory"""
+    fields = extract_trajectory_fields(response)
+    
     # Extract steps
-    steps_match = re.search(r'STEPS:\s*\[(.*?)\]', response, re.DOTALL | re.IGNORECASE)
-    if steps_match:
-        steps_text = steps_match.group(1)
+    steps_text = fields.get('STEPS')
+    if steps_text is not None:
         steps = tuple(ReasoningStep(s.strip()) for s in steps_text.split(';') if s.strip())
     else:
         # Fallback: use first 3 lines as steps
@@ -138,16 +317,16 @@ def parse_trajectory_response(query: str, response: str) -> Trajectory:
         steps = tuple(ReasoningStep(l) for l in lines) if lines else (ReasoningStep("Processed query"),)
     
     # Extract outcome
-    outcome_match = re.search(r'OUTCOME:\s*(.+?)(?=\n|$)', response, re.DOTALL | re.IGNORECASE)
-    outcome = outcome_match.group(1).strip() if outcome_match else response[:200]
+    outcome_text = fields.get('OUTCOME')
+    outcome = outcome_text.strip() if outcome_text is not None else response[:200]
     
     # Extract success
-    success_match = re.search(r'SUCCESS:\s*(true|false)', response, re.IGNORECASE)
-    success = success_match.group(1).lower() == 'true' if success_match else True
+    success_text = fields.get('SUCCESS')
+    success = success_text.lower() == 'true' if success_text is not None else True
     
     # Extract used bullets
-    bullets_match = re.search(r'USED_BULLETS:\s*\[(.*?)\]', response, re.IGNORECASE)
-    used_bullets = tuple(b.strip() for b in bullets_match.group(1).split(',') if b.strip()) if bullets_match else ()
+    bullets_text = fields.get('USED_BULLETS')
+    used_bullets = tuple(b.strip() for b in bullets_text.split(',') if b.strip()) if bullets_text is not None else ()
     
     return Trajectory(
         query=query,
@@ -157,17 +336,16 @@ def parse_trajectory_response(query: str, response: str) -> Trajectory:
         used_bullets=used_bullets
     )
 
+# Precompiled insight block pattern
+_INSIGHT_RE = re.compile(
+    r'\[Content:\s*(.+?);\s*Type:\s*(.+?);\s*Confidence:\s*([0-9.]+)\]',
+    re.DOTALL | re.IGNORECASE
+)
+
 def parse_insights_response(response: str, source_id: str) -> List[Insight]:
     """Parse LLM response into insights"""
-    # Extract insight blocks
-    blocks = re.findall(
-        r'\[Content:\s*(.+?);\s*Type:\s*(.+?);\s*Confidence:\s*([0-9.]+)\]',
-        response,
-        re.DOTALL | re.IGNORECASE
-    )
-    
     insights = []
-    for content, insight_type, confidence in blocks:
+    for content, insight_type, confidence in _INSIGHT_RE.findall(response):
         try:
             conf_val = float(confidence)
             if 0.0 <= conf_val <= 1.0:
@@ -182,10 +360,11 @@ def parse_insights_response(response: str, source_id: str) -> List[Insight]:
     
     # Fallback: extract first meaningful sentence as insight
     if not insights:
-        sentences = [s.strip() for s in response.split('.') if len(s.strip()) > 20]
-        if sentences:
+        # Stop at the first long enough sentence instead of stripping them all
+        sentence = next((s for s in map(str.strip, response.split('.')) if len(s) > 20), None)
+        if sentence:
             insights.append(Insight(
-                content=sentences[0],
+                content=sentence,
                 insight_type="strategy",
                 confidence=0.6,
                 source_id=source_id
@@ -200,6 +379,19 @@ def parse_insights_response(response: str, source_id: str) -> List[Insight]:
         )
     ]
 
+def fused_insight_text(response: str) -> str:
+    """Part of a fused trajectory+insight response that holds the insight"""
+    block = _INSIGHT_RE.search(response)
+    if block:
+        return response[block.start():]
+    # No insight block: only text after the trajectory fields may become one,
+    # so the STEPS/OUTCOME lines never turn into a fallback insight
+    end = max((m.end() for m in _FIELD_KEY_RE.finditer(response)), default=0)
+    if not end:
+        return response
+    newline = response.find('\n', end)
+    return response[newline + 1:] if newline >= 0 else ""
+
 def insights_to_delta(insights: List[Insight], min_confidence: float = 0.5) -> DeltaUpdate:
     """Convert insights to delta update"""
     bullets = []
@@ -220,3 +412,19 @@ def build_context_prompt(bullets: List[ContextBullet]) -> str:
         for b in bullets
     ]
     return "\n".join(parts)
+
+def pack_within_budget(
+    items: Iterable[str],
+    budget_chars: int = 8000,
+    per_item_max: int = 1200
+) -> List[str]:
+    """Greedily pack items (each capped at per_item_max) into budget_chars, truncating only the last"""
+    packed: List[str] = []
+    remaining = budget_chars
+    for item in items:
+        if remaining <= 0:
+            break
+        piece = item[:min(per_item_max, remaining)]
+        packed.append(piece)
+        remaining -= len(piece)
+    return packed
@@ -3,8 +3,13 @@ ACE Imperative Shell - Side Effects Layer
 Handles all I/O operations with Railway-Oriented Programming
 """
 import asyncio
+import hashlib
 import aiohttp
-from typing import Callable, TypeVar
+import orjson
+import os
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Optional, TypeVar
 from ace_types import Success, Failure, Result, OllamaConfig
 
 T = TypeVar('T')
@@ -13,19 +18,15 @@ U = TypeVar('U')
 # Railway-Oriented Programming utilities
 def bind(result: Result[T, str], func: Callable[[T], Result[U, str]]) -> Result[U, str]:
     """Bind operation for Result monad"""
-    match result:
-        case Success(value):
-            return func(value)
-        case Failure(error):
-            return Failure(error)
+    if isinstance(result, Success):
+        return func(result.value)
+    return Failure(result.error)
 
 def map_result(result: Result[T, str], func: Callable[[T], U]) -> Result[U, str]:
     """Map operation for Result monad"""
-    match result:
-        case Success(value):
-            return Success(func(value))
-        case Failure(error):
-            return Failure(error)
+    if isinstance(result, Success):
+        return Success(func(result.value))
+    return Failure(result.error)
 
 async def try_async(func: Callable, *args, **kwargs) -> Result[T, str]:
     """Execute async function and wrap in Result"""
@@ -35,6 +36,30 @@ async def try_async(func: Callable, *args, **kwargs) -> Result[T, str]:
     except Exception as e:
         return Failure(f"Error: {str(e)}")
 
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+async def _iter_ndjson(content: aiohttp.StreamReader):
+    """Yield decoded objects from an NDJSON byte stream, reassembling split lines"""
+    buf = bytearray()
+    async for chunk in content.iter_any():
+        buf += chunk
+        start = 0
+        while (nl := buf.find(b'\n', start)) >= 0:
+            line = buf[start:nl]
+            start = nl + 1
+            if line.strip():
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+        del buf[:start]
+    
+    if buf.strip():
+        try:
+            yield orjson.loads(buf)
+        except orjson.JSONDecodeError:
+            pass
+
 # Ollama API operations
 class OllamaClient:
     """Ollama API client with error handling"""
@@ -42,11 +67,37 @@ class OllamaClient:
     def __init__(self, config: OllamaConfig):
         self.config = config
         self.session: aiohttp.ClientSession | None = None
+        # Identical prompts already on the wire share one request: key -> [task, waiters]
+        self._inflight: dict[bytes, list] = {}
+        # Config is frozen, so the generation options are built once
+        self._options = {
+            "temperature": config.temperature,
+            "num_predict": config.max_tokens,
+            "num_ctx": config.context_window
+        }
+        self._thinking_options = {**self._options, "enable_thinking": True}
+        self._generate_url = f"{config.url}/api/generate"
+        # Keep in-flight requests at the server's parallel slot count
+        self.num_parallel = config.num_parallel or int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+        self._slots = asyncio.Semaphore(self.num_parallel)
+        self._requests = 0
+        self._coalesced = 0
+        self._queued = 0
     
     async def initialize(self) -> Result[bool, str]:
         """Initialize client"""
         try:
-            self.session = aiohttp.ClientSession()
+            # One persistent keep-alive pool for every request of this client
+            connector = aiohttp.TCPConnector(
+                limit=self.config.max_connections,
+                limit_per_host=self.config.max_connections,
+                keepalive_timeout=120,
+                ttl_dns_cache=300
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=120)
+            )
             async with self.session.get(f"{self.config.url}/api/tags") as resp:
                 if resp.status == 200:
                     return Success(True)
@@ -55,34 +106,62 @@ class OllamaClient:
             return Failure(f"Connection failed: {str(e)}")
     
     async def generate(self, prompt: str, enable_thinking: bool = False) -> Result[str, str]:
-        """Generate response from Ollama"""
+        """Generate response from Ollama, coalescing duplicate in-flight prompts"""
         if not self.session:
             return Failure("Client not initialized")
         
+        key = hashlib.blake2b(prompt.encode(), digest_size=16,
+                              person=b'think' if enable_thinking else b'').digest()
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self._generate_once(prompt, enable_thinking))
+            entry = self._inflight[key] = [task, 0]
+            task.add_done_callback(lambda _: self._release(key, entry))
+        else:
+            self._coalesced += 1
+        
+        task = entry[0]
+        entry[1] += 1
+        try:
+            # Shield so one cancelled caller does not cancel the shared request
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            # The last caller left before the result: free the Ollama slot
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+                self._release(key, entry)
+    
+    def _release(self, key: bytes, entry: list) -> None:
+        """Forget an in-flight request unless a newer one took its key"""
+        if self._inflight.get(key) is entry:
+            del self._inflight[key]
+    
+    async def _generate_once(self, prompt: str, enable_thinking: bool) -> Result[str, str]:
+        """Issue a single non-streaming generate request once a slot is free"""
+        async with self._acquire_slot():
+            return await self._post_generate(prompt, enable_thinking)
+    
+    async def _post_generate(self, prompt: str, enable_thinking: bool) -> Result[str, str]:
         payload = {
             "model": self.config.model,
             "prompt": prompt,
             "stream": False,
-            "options": {
-                "temperature": self.config.temperature,
-                "num_predict": self.config.max_tokens,
-                "num_ctx": self.config.context_window
-            }
+            "options": self._thinking_options if enable_thinking else self._options
         }
         
-        if enable_thinking:
-            payload["options"]["enable_thinking"] = True
-        
         timeout = 300 if enable_thinking else 120
         
         try:
+            # orjson bytes go straight on the wire (no str round trip)
             async with self.session.post(
-                f"{self.config.url}/api/generate",
-                json=payload,
+                self._generate_url,
+                data=orjson.dumps(payload),
+                headers=_JSON_HEADERS,
                 timeout=aiohttp.ClientTimeout(total=timeout)
             ) as resp:
                 if resp.status == 200:
-                    result = await resp.json()
+                    result = orjson.loads(await resp.read())
                     return Success(result.get('response', '').strip())
                 return Failure(f"API error: {resp.status}")
         except asyncio.TimeoutError:
@@ -96,55 +175,45 @@ class OllamaClient:
             yield Failure("Client not initialized")
             return
         
+        # Streams take no slot: the consumer can suspend the generator indefinitely mid-reply
+        
         payload = {
             "model": self.config.model,
             "prompt": prompt,
             "stream": True,
-            "options": {
-                "temperature": self.config.temperature,
-                "num_predict": self.config.max_tokens,
-                "num_ctx": self.config.context_window
-            }
+            "options": self._thinking_options if enable_thinking else self._options
         }
         
-        if enable_thinking:
-            payload["options"]["enable_thinking"] = True
-        
         timeout = 300 if enable_thinking else 120
         
         try:
-            import json
+            # orjson bytes go straight on the wire (no str round trip)
             async with self.session.post(
-                f"{self.config.url}/api/generate",
-                json=payload,
+                self._generate_url,
+                data=orjson.dumps(payload),
+                headers=_JSON_HEADERS,
                 timeout=aiohttp.ClientTimeout(total=timeout)
             ) as resp:
                 if resp.status == 200:
                     in_thinking = False
-                    async for line in resp.content:
-                        if line:
-                            try:
-                                data = json.loads(line.decode('utf-8'))
-                                
-                                # Handle thinking tokens
-                                if 'thinking' in data:
-                                    if not in_thinking:
-                                        yield Success("\n💭 [Thinking...] ")
-                                        in_thinking = True
-                                    yield Success(data['thinking'])
-                                    continue
-                                
-                                if in_thinking and 'response' in data:
-                                    yield Success("\n\n🤖 [Answer:] ")
-                                    in_thinking = False
-                                
-                                if 'response' in data:
-                                    yield Success(data['response'])
-                                
-                                if data.get('done', False):
-                                    break
-                            except json.JSONDecodeError:
-                                continue
+                    async for data in _iter_ndjson(resp.content):
+                        # Handle thinking tokens
+                        if 'thinking' in data:
+                            if not in_thinking:
+                                yield Success("\n💭 [Thinking...] ")
+                                in_thinking = True
+                            yield Success(data['thinking'])
+                            continue
+                        
+                        if in_thinking and 'response' in data:
+                            yield Success("\n\n🤖 [Answer:] ")
+                            in_thinking = False
+                        
+                        if 'response' in data:
+                            yield Success(data['response'])
+                        
+                        if data.get('done', False):
+                            break
                 else:
                     yield Failure(f"API error: {resp.status}")
         except asyncio.TimeoutError:
@@ -152,6 +221,40 @@ class OllamaClient:
         except Exception as e:
             yield Failure(f"Generation failed: {str(e)}")
     
+    def _acquire_slot(self) -> asyncio.Semaphore:
+        """Count the request (and whether it must queue) and return the slot semaphore"""
+        self._requests += 1
+        if self._slots.locked():
+            self._queued += 1
+        return self._slots
+    
+    @property
+    def stats(self) -> dict[str, int]:
+        """Request counters for tuning num_parallel"""
+        return {
+            "num_parallel": self.num_parallel,
+            "requests": self._requests,
+            "coalesced": self._coalesced,
+            "queued": self._queued,
+        }
+    
+    async def warmup(self) -> Result[bool, str]:
+        """Ask Ollama to load the model so the next request skips the cold start"""
+        if not self.session:
+            return Failure("Client not initialized")
+        
+        # An empty prompt only loads the model into memory, no tokens are generated
+        payload = {"model": self.config.model, "prompt": "", "stream": False}
+        try:
+            async with self.session.post(
+                self._generate_url, data=orjson.dumps(payload), headers=_JSON_HEADERS
+            ) as resp:
+                if resp.status == 200:
+                    return Success(True)
+                return Failure(f"API error: {resp.status}")
+        except Exception as e:
+            return Failure(f"Warmup failed: {str(e)}")
+    
     async def shutdown(self) -> Result[None, str]:
         """Shutdown client"""
         try:
@@ -161,6 +264,131 @@ class OllamaClient:
         except Exception as e:
             return Failure(f"Shutdown failed: {str(e)}")
 
+# Semantic cache operations
+class EmbeddingCache:
+    """Semantic LRU cache keyed by L2-normalized query embeddings"""
+    
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        threshold: float = 0.87,
+        max_size: int = 256,
+        model: Any = None
+    ):
+        # Heavy optional dependencies, imported only when the cache is enabled
+        import numpy as np
+        
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(model_name)
+        self.model = model
+        self.threshold = threshold
+        dim = self.model.get_sentence_embedding_dimension()
+        self._matrix = np.zeros((max_size, dim), dtype=np.float32)
+        self._entries: OrderedDict[int, Any] = OrderedDict()  # row -> value, LRU order
+        self._free = list(range(max_size - 1, -1, -1))
+    
+    def embed(self, text: str):
+        """Embed text as an L2-normalized vector (CPU-bound, run off the event loop)"""
+        return self.model.encode(text, normalize_embeddings=True)
+    
+    def _match(self, vec) -> Optional[int]:
+        """Row of the most similar live entry at or above threshold"""
+        if not self._entries:
+            return None
+        # Freed rows are zeroed, so they never outscore a live match
+        scores = self._matrix @ vec
+        row = int(scores.argmax())
+        if scores[row] < self.threshold or row not in self._entries:
+            return None
+        return row
+    
+    def lookup(self, vec) -> Optional[Any]:
+        """Return cached value whose key has cosine similarity >= threshold"""
+        row = self._match(vec)
+        if row is None:
+            return None
+        self._entries.move_to_end(row)
+        return self._entries[row]
+    
+    def evict(self, vec) -> None:
+        """Drop the entry lookup(vec) would return, if any"""
+        row = self._match(vec)
+        if row is not None:
+            del self._entries[row]
+            self._matrix[row] = 0
+            self._free.append(row)
+    
+    def insert(self, vec, value: Any) -> None:
+        """Insert value, evicting the least recently used entry when full"""
+        if self._free:
+            row = self._free.pop()
+        else:
+            row, _ = self._entries.popitem(last=False)
+        self._matrix[row] = vec
+        self._entries[row] = value
+    
+    def clear(self) -> None:
+        """Drop all cached entries"""
+        self._entries.clear()
+        self._matrix[:] = 0
+        self._free = list(range(len(self._matrix) - 1, -1, -1))
+
+def create_embedding_cache(config: OllamaConfig) -> Result[EmbeddingCache, str]:
+    """Create semantic cache from config"""
+    try:
+        return Success(EmbeddingCache(
+            config.embedding_model,
+            config.semantic_cache_threshold,
+            config.semantic_cache_size
+        ))
+    except ImportError as e:
+        return Failure(f"Semantic cache unavailable: {str(e)}")
+    except Exception as e:
+        return Failure(f"Semantic cache failed: {str(e)}")
+
+# Terminal output operations
+class TokenSink:
+    """Coalesce streamed chunks into periodic stdout writes"""
+    
+    def __init__(self, interval: float = 0.016, max_chars: int = 4096, stream: Any = None):
+        self.interval = interval
+        self.max_chars = max_chars
+        self.stream = stream if stream is not None else sys.stdout
+        self._parts: list[str] = []
+        self._size = 0
+        self._flusher: asyncio.Task | None = None
+    
+    def append(self, chunk: str) -> None:
+        """Buffer chunk, writing immediately once the size threshold is hit"""
+        self._parts.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.max_chars:
+            self.flush()
+    
+    def flush(self) -> None:
+        """Write buffered chunks in one call"""
+        if self._parts:
+            self.stream.write("".join(self._parts))
+            self._parts.clear()
+            self._size = 0
+            self.stream.flush()
+    
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
+    
+    async def __aenter__(self) -> "TokenSink":
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        self.flush()
+
 # Logging operations
 def log_info(message: str) -> None:
     """Log info message"""
@@ -0,0 +1,50 @@
+"""
+ACE LLM Cache - Exact-match response cache for tool prompts
+Wraps OllamaClient so tools can reuse answers to repeated prompts
+"""
+import hashlib
+import orjson
+from collections import OrderedDict
+from typing import Any
+from ace_types import Success, Result
+
+class LLMCache:
+    """LRU cache of successful generate() results, keyed by prompt and options"""
+    
+    def __init__(self, client: Any, max_size: int = 512):
+        self.client = client
+        self.max_size = max_size
+        self._entries: OrderedDict[str, Result[str, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _key(prompt: str, options: dict) -> str:
+        payload = orjson.dumps({"prompt": prompt, "kw": options}, option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(payload).hexdigest()
+    
+    async def generate(self, prompt: str, **options) -> Result[str, str]:
+        """Return cached response for prompt, generating it on a miss"""
+        key = self._key(prompt, options)
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached
+        
+        self.misses += 1
+        result = await self.client.generate(prompt, **options)
+        # Failures are not cached so the next call retries
+        if isinstance(result, Success):
+            self._entries[key] = result
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result
+    
+    def generate_stream(self, prompt: str, **options):
+        """Streaming responses are not cached"""
+        return self.client.generate_stream(prompt, **options)
+    
+    def clear(self) -> None:
+        """Drop all cached responses"""
+        self._entries.clear()
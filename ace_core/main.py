@@ -4,242 +4,357 @@ ACE System - Main Entry Point
 Functional + Railway-Oriented Programming
 """
 import asyncio
+import io
 import sys
+import threading
 from ace_types import OllamaConfig, Success, Failure
 from ace import ACEFramework
+from llm_cache import LLMCache
 from tools import ThinkingTool, SearchTool, DeepResearchTool
-from imperative_shell import log_info, log_success, log_error
+from imperative_shell import EmbeddingCache, TokenSink, log_info, log_success, log_error
 
-async def demo_mode(ace: ACEFramework) -> None:
-    """Demo mode - Test all features"""
-    log_info("ACE Demo Mode - Testing All Features")
-    print("\n" + "="*60)
-    
-    # 1. Basic ACE Query
-    print("\n🧪 Test 1: Basic ACE Query")
-    print("-" * 60)
-    query = "What is Agentic Context Engineering?"
-    print(f"Query: {query}")
-    print("\n🤖 Response:")
-    async for chunk in ace.process_query_stream(query):
-        print(chunk, end='', flush=True)
-    print()
-    stats = ace.get_context_stats()
-    print(f"📈 Context: {stats['total_bullets']} bullets learned")
-    
-    # 2. Context Learning
-    print("\n" + "="*60)
-    print("\n🧪 Test 2: Context Learning")
-    print("-" * 60)
-    query = "Write a Python function to calculate factorial"
-    print(f"Query: {query}")
-    print("\n🤖 Response:")
-    async for chunk in ace.process_query_stream(query):
-        print(chunk, end='', flush=True)
-    print()
-    stats = ace.get_context_stats()
-    print(f"📈 Context: {stats['total_bullets']} bullets learned")
-    
-    # 3. Search in Context
-    print("\n" + "="*60)
-    print("\n🧪 Test 3: Search in Context")
-    print("-" * 60)
+try:
+    from prompt_toolkit import PromptSession
+except ImportError:
+    PromptSession = None
+
+# Banners built once at import
+_BAR = "=" * 60 + "\n"
+_DASH = "-" * 60 + "\n"
+_SECTION = "\n" + _BAR
+_COMMANDS_BANNER = (
+    "\nCommands: 'stats', 'help', 'exit', '/think', '/search', '/research', "
+    "'/thinking on|off', '/web on|off'\n" + _DASH
+)
+
+# Streamed demo tests: (title, query)
+_DEMO_STREAM_TESTS = (
+    ("Test 1: Basic ACE Query", "What is Agentic Context Engineering?"),
+    ("Test 2: Context Learning", "Write a Python function to calculate factorial"),
+)
+def _test_header(out: io.StringIO, title: str) -> None:
+    """Write a demo test banner into out"""
+    out.write(f"{_SECTION}\n🧪 {title}\n{_DASH}")
+
+async def _demo_context_search(bullets: list) -> str:
+    """Test 3: Search in Context"""
+    out = io.StringIO()
+    _test_header(out, "Test 3: Search in Context")
     search_tool = SearchTool(enable_web_search=False)
-    context = ace.curator.get_context()
-    results = await search_tool.search("Python", list(context.bullets.values()))
-    print(f"🔍 Search 'Python': Found {len(results)} results")
+    results = await search_tool.search("Python", bullets)
+    print(f"🔍 Search 'Python': Found {len(results)} results", file=out)
     for i, r in enumerate(results[:2], 1):
-        print(f"  {i}. {r['content'][:60]}...")
-    
-    # 4. Thinking Mode
-    print("\n" + "="*60)
-    print("\n🧪 Test 4: Deep Thinking")
-    print("-" * 60)
+        print(f"  {i}. {r['content'][:60]}...", file=out)
+    return out.getvalue()
+
+async def _demo_thinking(ace: ACEFramework) -> str:
+    """Test 4: Deep Thinking"""
+    out = io.StringIO()
+    _test_header(out, "Test 4: Deep Thinking")
     thinking_tool = ThinkingTool()
     query = "Compare functional vs OOP"
-    print(f"Query: {query}")
-    print("\n🧠 Thinking:")
+    print(f"Query: {query}", file=out)
+    print("\n🧠 Thinking:", file=out)
     result = await thinking_tool.think(query, ace.client)
     match result:
         case Success(response):
-            print(response[:200] + "...")
+            print(response[:200] + "...", file=out)
         case Failure(error):
-            print(f"❌ {error}")
-    
-    # 5. Web Search (if enabled)
-    print("\n" + "="*60)
-    print("\n🧪 Test 5: Web Search")
-    print("-" * 60)
+            print(f"❌ {error}", file=out)
+    return out.getvalue()
+
+async def _demo_web_search(bullets: list) -> str:
+    """Test 5: Web Search"""
+    out = io.StringIO()
+    _test_header(out, "Test 5: Web Search")
     search_tool_web = SearchTool(enable_web_search=True)
-    print("🔍 Searching 'Python programming'...")
-    web_results = await search_tool_web.search("Python programming", list(context.bullets.values()))
-    print(f"Found {len(web_results)} results (context + web)")
+    print("🔍 Searching 'Python programming'...", file=out)
+    try:
+        web_results = await search_tool_web.search("Python programming", bullets)
+    finally:
+        await search_tool_web.aclose()
+    print(f"Found {len(web_results)} results (context + web)", file=out)
     for i, r in enumerate(web_results[:2], 1):
         source = "🌐" if r['source'] == 'web' else "📚"
-        print(f"  {i}. {source} {r['content'][:60]}...")
-    
-    # 6. Deep Research
-    print("\n" + "="*60)
-    print("\n🧪 Test 6: Deep Research")
-    print("-" * 60)
+        print(f"  {i}. {source} {r['content'][:60]}...", file=out)
+    return out.getvalue()
+
+async def _demo_research(ace: ACEFramework, bullets: list) -> str:
+    """Test 6: Deep Research"""
+    out = io.StringIO()
+    _test_header(out, "Test 6: Deep Research")
     research_tool = DeepResearchTool(enable_web_search=False)
     topic = "Functional Programming"
-    print(f"Topic: {topic}")
-    print("\n🔬 Researching...")
-    result = await research_tool.research(topic, ace.client, list(context.bullets.values()))
+    print(f"Topic: {topic}", file=out)
+    print("\n🔬 Researching...", file=out)
+    try:
+        result = await research_tool.research(topic, ace.client, bullets)
+    finally:
+        await research_tool.aclose()
     match result:
         case Success(report):
             lines = report.split('\n')
-            print('\n'.join(lines[:15]) + "\n...")
+            print('\n'.join(lines[:15]) + "\n...", file=out)
         case Failure(error):
-            print(f"❌ {error}")
+            print(f"❌ {error}", file=out)
+    return out.getvalue()
+
+async def demo_mode(ace: ACEFramework) -> None:
+    """Demo mode - Test all features"""
+    log_info("ACE Demo Mode - Testing All Features")
+    sys.stdout.write(_SECTION)
+    
+    # 1-2. Basic ACE Query + Context Learning
+    # Test 2 builds on the conversation Test 1 commits, so they run one after the other
+    for i, (title, query) in enumerate(_DEMO_STREAM_TESTS):
+        if i:
+            sys.stdout.write(_SECTION)
+        sys.stdout.write(f"\n🧪 {title}\n{_DASH}")
+        print(f"Query: {query}")
+        print("\n🤖 Response:")
+        async with TokenSink() as sink:
+            async for chunk in ace.process_query_stream(query):
+                sink.append(chunk)
+        print()
+        stats = ace.get_context_stats()
+        print(f"📈 Context: {stats['total_bullets']} bullets learned")
+    
+    # 3-6. Independent of each other once Tests 1-2 seeded the context:
+    # run concurrently, each into its own buffer, and print in order
+    bullets = list(ace.curator.get_context().bullets.values())
+    reports = await asyncio.gather(
+        _demo_context_search(bullets),
+        _demo_thinking(ace),
+        _demo_web_search(bullets),
+        _demo_research(ace, bullets),
+    )
+    for report in reports:
+        print(report, end='')
     
     # Final Stats
-    print("\n" + "="*60)
-    print("\n📊 Final Statistics")
-    print("-" * 60)
+    sys.stdout.write(_SECTION)
+    sys.stdout.write(f"\n📊 Final Statistics\n{_DASH}")
     stats = ace.get_context_stats()
     print(f"  Total bullets: {stats['total_bullets']}")
     print(f"  Helpful bullets: {stats['helpful_bullets']}")
     print(f"  Context version: {stats['version']}")
     print(f"  Avg helpfulness: {stats['avg_helpfulness']:.2f}")
     print("\n✅ All tests completed!")
-    print("="*60)
+    sys.stdout.write(_BAR)
+
+def _settle(future: asyncio.Future, line: str | None, error: BaseException | None) -> None:
+    """Resolve a pending input future unless it was already cancelled"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(line)
+
+async def read_input(session, message: str) -> str:
+    """Read a line without blocking the event loop"""
+    if session is not None:
+        return await session.prompt_async(message)
+    # A daemon thread, unlike the default executor, does not hold up
+    # shutdown while input() is still blocked after Ctrl-C
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    
+    def read() -> None:
+        line, error = None, None
+        try:
+            line = input(message)
+        except Exception as e:
+            error = e
+        try:
+            loop.call_soon_threadsafe(_settle, future, line, error)
+        except RuntimeError:
+            pass  # Loop already closed
+    
+    threading.Thread(target=read, daemon=True).start()
+    return await future
 
 async def interactive_mode(ace: ACEFramework) -> None:
     """Interactive chat mode"""
     log_info("ACE Interactive Mode")
     thinking_tool = ThinkingTool()
-    web_search_enabled = False
-    search_tool = SearchTool(enable_web_search=web_search_enabled)
-    research_tool = DeepResearchTool(enable_web_search=web_search_enabled)
+    search_tool = SearchTool(enable_web_search=False)
+    # Finished reports are cached by topic, sharing the query cache's embedding model
+    answer_cache = None
+    if ace.cache is not None:
+        answer_cache = EmbeddingCache(
+            threshold=ace.config.semantic_cache_threshold, max_size=64, model=ace.cache.model
+        )
+    research_tool = DeepResearchTool(enable_web_search=False, answer_cache=answer_cache)
+    # Repeated /think and /research prompts are answered from memory
+    tool_client = LLMCache(ace.client)
     thinking_mode = False
-    print("\nCommands: 'stats', 'help', 'exit', '/think', '/search', '/research', '/thinking on|off', '/web on|off'")
-    print("-" * 60)
+    session = PromptSession() if PromptSession is not None else None
+    warmup_task: asyncio.Task | None = None
+    
+    # Command handlers return True to leave the chat loop
+    async def handle_exit(_: str) -> bool:
+        log_info("Goodbye!")
+        return True
+    
+    async def handle_stats(_: str) -> bool:
+        stats = ace.get_context_stats()
+        print(f"\n📊 Context Statistics:")
+        print(f"  Total bullets: {stats['total_bullets']}")
+        print(f"  Helpful bullets: {stats['helpful_bullets']}")
+        print(f"  Version: {stats['version']}")
+        print(f"  Avg helpfulness: {stats['avg_helpfulness']:.2f}")
+        return False
+    
+    async def handle_help(_: str) -> bool:
+        print("\n📖 ACE Framework Help")
+        print("  - Ask any question naturally")
+        print("  - 'stats' - Show context statistics")
+        print("  - '/think <query>' - Deep thinking mode")
+        print("  - '/search <query>' - Search in context/web")
+        print("  - '/research <topic>' - Deep research mode")
+        print("  - '/thinking on|off' - Toggle native thinking mode")
+        print("  - '/web on|off' - Toggle web search (like OpenAI)")
+        print("  - 'exit' - Exit system")
+        return False
+    
+    async def handle_thinking(arg: str) -> bool:
+        nonlocal thinking_mode
+        mode = arg.strip().lower()
+        if mode == 'on':
+            thinking_mode = True
+            log_success("Native thinking mode enabled")
+        elif mode == 'off':
+            thinking_mode = False
+            log_success("Native thinking mode disabled")
+        else:
+            log_error("Use: /thinking on or /thinking off")
+        return False
+    
+    async def handle_web(arg: str) -> bool:
+        mode = arg.strip().lower()
+        if mode in ('on', 'off'):
+            # Tools persist across toggles, keeping their caches warm
+            search_tool.set_web_enabled(mode == 'on')
+            research_tool.set_web_enabled(mode == 'on')
+            log_success("🌐 Web search enabled (like OpenAI)" if mode == 'on' else "Web search disabled")
+        else:
+            log_error("Use: /web on or /web off")
+        return False
+    
+    async def handle_think(query: str) -> bool:
+        print(f"\n🧠 Thinking:")
+        result = await thinking_tool.think(query, tool_client)
+        match result:
+            case Success(response):
+                print(response)
+            case Failure(error):
+                log_error(f"Error: {error}")
+        return False
+    
+    async def handle_search(query: str) -> bool:
+        context = ace.curator.get_context()
+        print(f"\n🔍 Searching...")
+        results = await search_tool.search(query, list(context.bullets.values()), context.version)
+        if not results:
+            print("No results found.")
+        else:
+            for i, r in enumerate(results, 1):
+                source = "🌐" if r['source'] == 'web' else "📚"
+                print(f"{i}. {source} {r['content'][:100]}...")
+                if 'url' in r and r['url']:
+                    print(f"   🔗 {r['url']}")
+        return False
+    
+    async def handle_research(topic: str) -> bool:
+        print(f"\n🔬 Researching:")
+        context = ace.curator.get_context()
+        async with TokenSink() as sink:
+            result = await research_tool.research(
+                topic, tool_client, list(context.bullets.values()), on_chunk=sink.append
+            )
+        match result:
+            case Success(_):
+                print()  # Report was streamed
+            case Failure(error):
+                log_error(f"Error: {error}")
+        return False
+    
+    # Bare commands must be the whole input; slash commands take an argument
+    bare_commands = {
+        'exit': handle_exit,
+        'quit': handle_exit,
+        'stats': handle_stats,
+        'help': handle_help,
+    }
+    arg_commands = {
+        '/thinking': handle_thinking,
+        '/web': handle_web,
+        '/think': handle_think,
+        '/search': handle_search,
+        '/research': handle_research,
+    }
+    model_commands = (handle_think, handle_research)
+    
+    sys.stdout.write(_COMMANDS_BANNER)
     
     while True:
         try:
-            user_input = input("\n👤 You: ").strip()
+            user_input = (await read_input(session, "\n👤 You: ")).strip()
             
             if not user_input:
                 continue
             
-            if user_input.lower() in ['exit', 'quit']:
-                log_info("Goodbye!")
-                break
+            cmd, _, arg = user_input.partition(' ')
+            handler = (arg_commands if arg else bare_commands).get(cmd.lower())
             
-            if user_input.lower() == 'stats':
-                stats = ace.get_context_stats()
-                print(f"\n📊 Context Statistics:")
-                print(f"  Total bullets: {stats['total_bullets']}")
-                print(f"  Helpful bullets: {stats['helpful_bullets']}")
-                print(f"  Version: {stats['version']}")
-                print(f"  Avg helpfulness: {stats['avg_helpfulness']:.2f}")
-                continue
+            # Reload the model if it was evicted while the user was idle, only for
+            # lines that reach it and unless the previous warmup is still on the wire
+            if (handler is None or handler in model_commands) and (
+                warmup_task is None or warmup_task.done()
+            ):
+                warmup_task = asyncio.create_task(ace.client.warmup())
             
-            if user_input.lower() == 'help':
-                print("\n📖 ACE Framework Help")
-                print("  - Ask any question naturally")
-                print("  - 'stats' - Show context statistics")
-                print("  - '/think <query>' - Deep thinking mode")
-                print("  - '/search <query>' - Search in context/web")
-                print("  - '/research <topic>' - Deep research mode")
-                print("  - '/thinking on|off' - Toggle native thinking mode")
-                print("  - '/web on|off' - Toggle web search (like OpenAI)")
-                print("  - 'exit' - Exit system")
-                continue
-            
-            if user_input.lower().startswith('/thinking '):
-                mode = user_input[10:].strip().lower()
-                if mode == 'on':
-                    thinking_mode = True
-                    log_success("Native thinking mode enabled")
-                elif mode == 'off':
-                    thinking_mode = False
-                    log_success("Native thinking mode disabled")
-                else:
-                    log_error("Use: /thinking on or /thinking off")
-                continue
-            
-            if user_input.lower().startswith('/web '):
-                mode = user_input[5:].strip().lower()
-                if mode == 'on':
-                    web_search_enabled = True
-                    search_tool = SearchTool(enable_web_search=True)
-                    research_tool = DeepResearchTool(enable_web_search=True)
-                    log_success("🌐 Web search enabled (like OpenAI)")
-                elif mode == 'off':
-                    web_search_enabled = False
-                    search_tool = SearchTool(enable_web_search=False)
-                    research_tool = DeepResearchTool(enable_web_search=False)
-                    log_success("Web search disabled")
-                else:
-                    log_error("Use: /web on or /web off")
-                continue
-            
-            if user_input.startswith('/think '):
-                query = user_input[7:]
-                print(f"\n🧠 Thinking:")
-                result = await thinking_tool.think(query, ace.client)
-                match result:
-                    case Success(response):
-                        print(response)
-                    case Failure(error):
-                        log_error(f"Error: {error}")
-                continue
-            
-            if user_input.startswith('/search '):
-                query = user_input[8:]
-                context = ace.curator.get_context()
-                print(f"\n🔍 Searching...")
-                results = await search_tool.search(query, list(context.bullets.values()))
-                if not results:
-                    print("No results found.")
-                else:
-                    for i, r in enumerate(results, 1):
-                        source = "🌐" if r['source'] == 'web' else "📚"
-                        print(f"{i}. {source} {r['content'][:100]}...")
-                        if 'url' in r and r['url']:
-                            print(f"   🔗 {r['url']}")
-                continue
-            
-            if user_input.startswith('/research '):
-                topic = user_input[10:]
-                print(f"\n🔬 Researching:")
-                context = ace.curator.get_context()
-                result = await research_tool.research(topic, ace.client, list(context.bullets.values()))
-                match result:
-                    case Success(response):
-                        print(response)
-                    case Failure(error):
-                        log_error(f"Error: {error}")
+            if handler is not None:
+                if await handler(arg):
+                    break
                 continue
             
             # Process query with streaming
+            pre_version = ace.curator.get_context().version
             print(f"\n🤖 ACE:")
-            if thinking_mode:
-                async for result in ace.client.generate_stream(user_input, enable_thinking=True):
-                    match result:
-                        case Success(chunk):
-                            print(chunk, end='', flush=True)
-                        case Failure(error):
-                            log_error(f"Error: {error}")
-                            break
-            else:
-                async for chunk in ace.process_query_stream(user_input):
-                    print(chunk, end='', flush=True)
+            async with TokenSink() as sink:
+                if thinking_mode:
+                    async for result in ace.client.generate_stream(user_input, enable_thinking=True):
+                        match result:
+                            case Success(chunk):
+                                sink.append(chunk)
+                            case Failure(error):
+                                sink.flush()
+                                log_error(f"Error: {error}")
+                                break
+                else:
+                    async for chunk in ace.process_query_stream(user_input):
+                        sink.append(chunk)
             print()  # New line
             
-            # Show stats
-            stats = ace.get_context_stats()
-            if stats['total_bullets'] > 0:
-                print(f"💡 Context: {stats['total_bullets']} bullets learned")
+            # Show stats only when this turn changed the context
+            if ace.curator.get_context().version != pre_version:
+                stats = ace.get_context_stats()
+                if stats['total_bullets'] > 0:
+                    print(f"💡 Context: {stats['total_bullets']} bullets learned")
         
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError, asyncio.CancelledError):
+            # Without prompt_toolkit, Ctrl-C arrives as cancellation of the main task
             log_info("\nGoodbye!")
             break
         except Exception as e:
             log_error(f"Unexpected error: {e}")
+    
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await search_tool.aclose()
+    await research_tool.aclose()
 
 async def main():
     """Main entry point"""
@@ -278,5 +393,15 @@ async def main():
         await ace.shutdown()
         log_success("ACE Framework shutdown complete")
 
+def run(coro):
+    """Run coroutine on uvloop when available, else the default asyncio loop"""
+    if sys.platform != 'win32':
+        try:
+            import uvloop
+            return uvloop.run(coro)
+        except ImportError:
+            pass
+    return asyncio.run(coro)
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    run(main())
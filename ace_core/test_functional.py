@@ -3,12 +3,21 @@
 Test Functional Core - Pure Functions
 Demonstrates functional programming principles
 """
-from ace_types import ContextBullet, ContextState, ReasoningStep, Trajectory, Insight
+import asyncio
+import functools
+import io
+try:
+    import numpy as np
+except ImportError:  # Semantic cache tests are skipped without numpy
+    np = None
+from ace_types import ContextBullet, ContextState, ReasoningStep, Trajectory, Insight, DeltaUpdate, Success, Failure
 from functional_core import (
     create_bullet, update_bullet_feedback, score_bullet,
-    get_relevant_bullets, find_duplicate_bullet, merge_delta,
+    get_relevant_bullets, find_duplicate_bullet, merge_delta, apply_feedback,
     prune_low_quality_bullets, limit_context_size,
-    parse_trajectory_response, parse_insights_response, insights_to_delta
+    parse_trajectory_response, parse_insights_response, insights_to_delta,
+    fused_insight_text,
+    pack_within_budget
 )
 
 def test_bullet_operations():
@@ -27,6 +36,12 @@ def test_bullet_operations():
     query_words = {"validate", "input", "check"}
     score = score_bullet(bullet2, query_words)
     print(f"✅ Bullet score: {score}")
+    
+    # Bullets built directly get the same word set as create_bullet
+    direct = ContextBullet(id="test", content="Validate input data", helpful_count=5)
+    assert direct.word_set == create_bullet("Validate input data").word_set
+    assert score_bullet(direct, {"validate", "input"}) == 2.5
+    print(f"✅ Direct bullet score: {score_bullet(direct, {'validate', 'input'})}")
 
 def test_context_operations():
     """Test context operations"""
@@ -51,6 +66,84 @@ def test_context_operations():
     duplicate_id = find_duplicate_bullet(new_bullet, context.bullets)
     print(f"✅ Duplicate detection: {duplicate_id or 'None found'}")
 
+def test_postings_index():
+    """Test incremental postings index"""
+    print("\n🧪 Testing Postings Index")
+    
+    delta = DeltaUpdate(bullets=(
+        create_bullet("Validate input before processing", ["strategy"]),
+        create_bullet("Log all operations", ["optimization"])
+    ))
+    context = merge_delta(ContextState(bullets={}), delta)
+    consistent = context.postings == ContextState(bullets=context.bullets).postings
+    assert consistent
+    print(f"✅ Incremental postings match rebuild: {consistent}")
+    
+    pruned = prune_low_quality_bullets(context, min_days_old=-1)
+    assert pruned.postings == {}
+    print(f"✅ Postings emptied after prune: {pruned.postings == {}}")
+    
+    # Postings are keyed by mapping key, which need not equal bullet.id
+    labelled = ContextState(bullets={
+        "b1": update_bullet_feedback(create_bullet("Validate input before processing"), True),
+        "b2": create_bullet("Validate output before returning")
+    })
+    pruned = prune_low_quality_bullets(labelled, min_days_old=-1)
+    assert pruned.postings == ContextState(bullets=pruned.bullets).postings
+    relevant = get_relevant_bullets(pruned, "validate before")
+    duplicate = find_duplicate_bullet(create_bullet("validate output before returning"), pruned.bullets, postings=pruned.postings)
+    assert [b.content for b in relevant] == ["Validate input before processing"] and duplicate is None
+    print("✅ Label-keyed prune leaves no stale postings")
+    
+    # With several matches the earliest created bullet wins, as in a linear scan
+    twins = ContextState(bullets={
+        b.id: b for b in (create_bullet(f"Retry failed requests with backoff {tag}") for tag in "abcdefgh")
+    })
+    first_id = next(iter(twins.bullets))
+    probe = create_bullet("Retry failed requests with backoff")
+    assert find_duplicate_bullet(probe, twins.bullets, postings=twins.postings) == first_id
+    assert find_duplicate_bullet(probe, twins.bullets) == first_id
+    print("✅ Duplicate match is deterministic (earliest bullet)")
+
+def test_tie_break():
+    """Test equal scores keep the oldest bullets whatever the backing map"""
+    print("\n🧪 Testing Tie Break")
+    from datetime import datetime, timedelta
+    from functional_core import empty_mapping, begin_update, finish_update
+    
+    start = datetime.now()
+    bullets = [
+        ContextBullet(id=f"b{i}", content="validate input", created_at=start - timedelta(seconds=8 - i))
+        for i in range(8)
+    ]
+    mutation = begin_update(empty_mapping())
+    for bullet in bullets:
+        mutation[bullet.id] = bullet
+    context = ContextState(bullets=finish_update(mutation))
+    
+    kept = limit_context_size(context, max_size=3)
+    relevant = get_relevant_bullets(context, "validate input", max_bullets=3)
+    assert sorted(kept.bullets) == ["b0", "b1", "b2"]
+    assert [b.id for b in relevant] == ["b0", "b1", "b2"]
+    print(f"✅ Ties keep the oldest bullets: {sorted(kept.bullets)}")
+
+def test_running_totals():
+    """Test incrementally maintained feedback aggregates"""
+    print("\n🧪 Testing Running Totals")
+    
+    def totals(ctx):
+        return (ctx.helpful_total, ctx.harmful_total, ctx.helpful_count_bullets)
+    
+    b1 = create_bullet("Validate input before processing", ["strategy"])
+    b2 = create_bullet("Log all operations", ["optimization"])
+    context = merge_delta(ContextState(bullets={}), DeltaUpdate(bullets=(b1, b2, b1)))
+    context = apply_feedback(context, [b2.id, b2.id], False)
+    context = prune_low_quality_bullets(context)
+    
+    rebuilt = ContextState(bullets=context.bullets)
+    assert totals(context) == totals(rebuilt) == (1, 0, 1)
+    print(f"✅ Incremental totals match rebuild: {totals(context)}")
+
 def test_immutability():
     """Test immutability of data structures"""
     print("\n🧪 Testing Immutability")
@@ -88,6 +181,76 @@ def test_parsing():
     """
     insights = parse_insights_response(insights_response, "source1")
     print(f"✅ Parsed {len(insights)} insights")
+    
+    # Fused response without an insight block: trajectory text must not become an insight
+    fused = response + "\nAlways confirm the input format before parsing."
+    fused_insights = parse_insights_response(fused_insight_text(fused), "q")
+    assert [i.content for i in fused_insights] == ["Always confirm the input format before parsing"]
+    bare_insights = parse_insights_response(fused_insight_text(response), "q")
+    assert [i.content for i in bare_insights] == ["Task completed successfully"]
+    blocked = fused_insight_text(response + insights_response)
+    assert len(parse_insights_response(blocked, "q")) == 2
+    print("✅ Fused response insights ignore the trajectory block")
+
+def test_prompt_budget():
+    """Test greedy prompt packing"""
+    print("\n🧪 Testing Prompt Budget")
+    
+    items = ["a" * 10, "b" * 50, "c" * 30, "d" * 5]
+    packed = pack_within_budget(items, budget_chars=60, per_item_max=40)
+    
+    assert packed == ["a" * 10, "b" * 40, "c" * 10]
+    assert pack_within_budget(["short"], budget_chars=100) == ["short"]
+
+    # Research prompts never exceed the original fixed slices (2x150 context, 3x200 sources)
+    from tools import _pack_answer_context, _pack_sources
+    for sizes in ((1000,) * 5, (120, 90, 40), (10,) * 5, (300, 5), ()):
+        results = [{'content': chr(97 + i) * n} for i, n in enumerate(sizes)]
+        old_context = "\n".join([r['content'][:150] for r in results[:2]])
+        old_sources = "\n".join([f"- {r['content'][:200]}" for r in results[:3]])
+        assert len(_pack_answer_context(results)) <= len(old_context)
+        assert len(_pack_sources(results)) <= len(old_sources)
+    long_results = [{'content': "x" * 1000}] * 5
+    assert len(_pack_sources(long_results)) < len("\n".join(["- " + "x" * 200] * 3))
+    print(f"✅ Packed {len(packed)}/{len(items)} items into {sum(map(len, packed))} chars")
+
+class LetterModel:
+    """Bag-of-letters embedder standing in for a sentence transformer"""
+    def get_sentence_embedding_dimension(self):
+        return 26
+    
+    def encode(self, text, normalize_embeddings=True):
+        vec = np.array([text.lower().count(c) for c in "abcdefghijklmnopqrstuvwxyz"], dtype=np.float32)
+        return vec / (np.linalg.norm(vec) or 1.0)
+
+def test_embedding_cache():
+    """Test semantic LRU cache hit, miss and eviction"""
+    print("\n🧪 Testing Embedding Cache")
+    if np is None:
+        print("⏭️  Skipped (numpy not installed)")
+        return
+    from imperative_shell import EmbeddingCache
+    
+    cache = EmbeddingCache(threshold=0.95, max_size=2, model=LetterModel())
+    assert cache.lookup(cache.embed("anything")) is None  # Empty cache
+    cache.insert(cache.embed("validate input"), "A")
+    cache.insert(cache.embed("handle errors"), "B")
+    
+    assert cache.lookup(cache.embed("Validate input!")) == "A"  # Same letters, new text
+    assert cache.lookup(cache.embed("xyz quiz jazz")) is None
+    cache.insert(cache.embed("log operations"), "C")  # Full: evicts B, the least recent
+    assert cache.lookup(cache.embed("handle errors")) is None
+    assert cache.lookup(cache.embed("validate input")) == "A"
+    assert cache.lookup(cache.embed("log operations")) == "C"
+    print("✅ Similar queries hit, dissimilar miss, LRU entry evicted")
+    
+    cache.clear()
+    assert cache.lookup(cache.embed("validate input")) is None
+    cache.insert(cache.embed("handle error"), "B2")  # Reuses a row; the old "handle errors" row is freed
+    assert cache.lookup(cache.embed("handle errors")) == "B2"  # Freed rows never win the argmax
+    cache.evict(cache.embed("handle errors"))
+    assert cache.lookup(cache.embed("handle error")) is None
+    print("✅ Cleared and evicted rows are masked, free rows reused")
 
 def test_railway_pattern():
     """Test railway-oriented programming pattern"""
@@ -110,21 +273,191 @@ def test_railway_pattern():
         case Failure(error):
             print(f"❌ Pattern match Failure: {error}")
 
-def main():
+class CountingClient:
+    """Fake Ollama client counting generate calls: replies with `reply`, else echoes the prompt upper-cased"""
+    def __init__(self, reply=None):
+        self.calls = 0
+        self.reply = reply
+    
+    async def generate(self, prompt, enable_thinking=False):
+        self.calls += 1
+        if prompt == "fail":
+            return Failure("down")
+        return Success(self.reply if self.reply is not None else prompt.upper())
+
+def async_test(test):
+    """Run an async test with asyncio.run when called directly (pytest); main() gathers __wrapped__"""
+    @functools.wraps(test)
+    def run():
+        asyncio.run(test())
+    return run
+
+@async_test
+async def test_shell_requires_initialize():
+    """Test shell operations fail cleanly before initialize (no network)"""
+    from ace_types import OllamaConfig, Failure
+    from imperative_shell import OllamaClient
+    
+    client = OllamaClient(OllamaConfig())
+    result = await client.generate("hello")
+    assert isinstance(result, Failure)
+    print(f"\n✅ Uninitialized client returns Failure: {result.error}")
+
+@async_test
+async def test_generate_cancellation():
+    """Test a coalesced request is cancelled once every caller is"""
+    from ace_types import OllamaConfig
+    from imperative_shell import OllamaClient
+    
+    client = OllamaClient(OllamaConfig())
+    client.session = object()  # The request itself is replaced below, no network
+    started = asyncio.Event()
+    cancelled = []
+    
+    async def slow_request(prompt, enable_thinking):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(prompt)
+            raise
+    client._generate_once = slow_request
+    
+    callers = [asyncio.create_task(client.generate("same prompt")) for _ in range(3)]
+    await started.wait()
+    callers[0].cancel()
+    await asyncio.sleep(0)
+    assert not cancelled  # Two callers still wait on the shared request
+    for caller in callers[1:]:
+        caller.cancel()
+    await asyncio.gather(*callers, return_exceptions=True)
+    await asyncio.sleep(0)
+    
+    assert cancelled == ["same prompt"] and not client._inflight
+    print("\n✅ Cancelling every caller cancels the shared request")
+
+@async_test
+async def test_token_sink():
+    """Test buffered token output"""
+    from imperative_shell import TokenSink
+    
+    out = io.StringIO()
+    async with TokenSink(interval=0.005, max_chars=8, stream=out) as sink:
+        sink.append("abc")
+        buffered = out.getvalue() == ""
+        sink.append("defgh")
+        size_flush = out.getvalue() == "abcdefgh"
+        sink.append("x")
+        await asyncio.sleep(0.05)
+        timed_flush = out.getvalue() == "abcdefghx"
+        sink.append("yz")
+    
+    assert buffered and size_flush and timed_flush and out.getvalue() == "abcdefghxyz"
+    print(f"\n✅ TokenSink buffers, flushes on size/interval/exit: {out.getvalue()!r}")
+
+@async_test
+async def test_llm_cache():
+    """Test exact-match LLM response cache"""
+    from ace_types import Success, Failure
+    from llm_cache import LLMCache
+    
+    client = CountingClient()
+    cache = LLMCache(client, max_size=2)
+    first = await cache.generate("a")
+    again = await cache.generate("a")
+    thinking = await cache.generate("a", enable_thinking=True)
+    await cache.generate("fail")
+    await cache.generate("fail")
+    
+    assert first == again == Success("A") and isinstance(thinking, Success)
+    assert client.calls == 4 and cache.hits == 1
+    print(f"\n✅ LLMCache: {cache.hits} hit, {client.calls} client calls (failures not cached)")
+
+@async_test
+async def test_research_fast_path():
+    """Test trivial research topics skip the LLM only when sources match"""
+    from ace_types import Success
+    from tools import DeepResearchTool
+    
+    tool = DeepResearchTool()
+    client = CountingClient(reply="What is it?")
+    bullets = [create_bullet("What it is depends on the context")]
+    
+    quick = await tool.research("what is it", client, bullets)
+    assert client.calls == 0 and "depends on the context" in quick.value
+    
+    # Nothing found: fall through to full research instead of an empty answer
+    full = await tool.research("what is it", client, [])
+    assert client.calls == 3 and "Step 4" in full.value
+    
+    await tool.research("Kubernetes", client, bullets)
+    assert client.calls == 6  # A one-word topic is not trivial
+    await tool.aclose()
+    print(f"\n✅ Research fast path: {client.calls} LLM calls across 3 topics")
+
+@async_test
+async def test_research_answer_cache():
+    """Test similar research topics are answered from the report cache"""
+    if np is None:
+        print("\n⏭️  Research answer cache skipped (numpy not installed)")
+        return
+    from ace_types import Success
+    from imperative_shell import EmbeddingCache
+    from tools import DeepResearchTool
+    
+    client = CountingClient(reply="Which parts matter?")
+    tool = DeepResearchTool(answer_cache=EmbeddingCache(threshold=0.95, max_size=4, model=LetterModel()))
+    first = await tool.research("Functional programming", client, [])
+    calls = client.calls
+    again = await tool.research("functional programming!", client, [])
+    assert again.value == first.value and client.calls == calls
+    
+    tool.answer_ttl = 0.0  # Expired reports are researched again
+    await tool.research("Functional programming", client, [])
+    assert client.calls == 2 * calls
+    
+    tool.answer_ttl = 3600.0  # ...and the fresh report replaces the expired one
+    await tool.research("Functional programming", client, [])
+    assert client.calls == 2 * calls and len(tool.answer_cache._entries) == 1
+    await tool.aclose()
+    print(f"\n✅ Research answer cache: similar topic reused, {client.calls} LLM calls")
+
+SYNC_TESTS = (
+    test_bullet_operations,
+    test_context_operations,
+    test_postings_index,
+    test_tie_break,
+    test_running_totals,
+    test_immutability,
+    test_parsing,
+    test_prompt_budget,
+    test_embedding_cache,
+    test_railway_pattern,
+)
+
+# Independent async tests run concurrently so their waits overlap
+ASYNC_TESTS = (
+    test_shell_requires_initialize,
+    test_generate_cancellation,
+    test_token_sink,
+    test_llm_cache,
+    test_research_fast_path,
+    test_research_answer_cache,
+)
+
+async def main():
     """Run all tests"""
     print("="*60)
     print("ACE Functional Core Tests")
     print("="*60)
     
-    test_bullet_operations()
-    test_context_operations()
-    test_immutability()
-    test_parsing()
-    test_railway_pattern()
+    for test in SYNC_TESTS:
+        test()
+    await asyncio.gather(*(test.__wrapped__() for test in ASYNC_TESTS))
     
     print("\n" + "="*60)
     print("✅ All tests passed!")
     print("="*60)
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
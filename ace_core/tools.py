@@ -1,17 +1,44 @@
 """
 ACE Tools - Thinking, Search, Deep Research
 """
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
+from collections import OrderedDict
+from operator import itemgetter
 from ace_types import Result, Success, Failure
+from functional_core import tokenize, pack_within_budget
+from imperative_shell import EmbeddingCache
 import asyncio
+import heapq
+import time
 import aiohttp
+import orjson
 
-class ThinkingTool:
-    """Extended reasoning with step-by-step thinking"""
-    
-    async def think(self, query: str, ollama_client) -> Result[str, str]:
-        """Generate deep thinking process with native thinking support"""
-        prompt = f"""Think deeply about this query step by step:
+_RELEVANCE = itemgetter('relevance')
+
+_DDG_URL = "https://api.duckduckgo.com/"
+_DDG_PARAMS = {"format": "json", "no_html": "1", "skip_disambig": "1"}
+
+# Words too common to signal relevance in a context search
+_STOPWORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in",
+    "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "with"
+})
+
+# Prompt budgets in characters (~4 chars per token; Ollama exposes no tokenizer).
+# Item counts and per-item caps never exceed the original 2x150 context and
+# 3x200 source slices; the shared budget trims further when every item is long.
+_CHARS_PER_TOKEN = 4
+_ANSWER_CONTEXT_ITEMS = 2
+_ANSWER_CONTEXT_MAX_CHARS = 150
+_ANSWER_CONTEXT_BUDGET = 60 * _CHARS_PER_TOKEN
+_SOURCE_ITEMS = 3
+_SOURCE_MAX_CHARS = 2 + 200
+_SOURCES_BUDGET = 120 * _CHARS_PER_TOKEN
+_FINDINGS_BUDGET = 2048 * _CHARS_PER_TOKEN
+
+# Prompt templates, built once at import and filled per call
+_THINK_TMPL = """Think deeply about this query step by step:
 
 Query: {query}
 
@@ -22,23 +49,99 @@ Provide detailed reasoning:
 4. Reach conclusion
 
 Thinking process:"""
-        
+
+_QUESTIONS_TMPL = """Research topic: {topic}
+
+Based on available information, generate 3 specific research questions to explore:"""
+
+_ANSWER_TMPL = """Question: {question}
+
+Relevant information:
+{context_info}
+
+Provide detailed answer:"""
+
+_SYNTH_TMPL = """Research topic: {topic}
+
+Sources consulted:
+{sources_text}
+
+Research findings:
+{findings_text}
+
+Synthesize a comprehensive, well-structured report with:
+1. Executive summary
+2. Key findings
+3. Detailed analysis
+4. Conclusion
+
+Report:"""
+
+def _is_trivial_topic(topic: str) -> bool:
+    """No meaningful word: only stopwords or punctuation (one-word topics still count)"""
+    return not any(
+        w not in _STOPWORDS and any(c.isalnum() for c in w) for w in topic.lower().split()
+    )
+
+def _pack_answer_context(results: List[Dict]) -> str:
+    """Context lines for one answer prompt, packed into the answer budget"""
+    return "\n".join(pack_within_budget(
+        (r['content'] for r in results[:_ANSWER_CONTEXT_ITEMS]),
+        _ANSWER_CONTEXT_BUDGET, per_item_max=_ANSWER_CONTEXT_MAX_CHARS
+    ))
+
+def _pack_sources(results: List[Dict]) -> str:
+    """Source lines for the synthesis prompt, packed into the sources budget"""
+    # Slice before formatting so a long source is never copied whole
+    # (result dicts are shared with the search cache, so nothing is stored on them)
+    return "\n".join(pack_within_budget(
+        (f"- {r['content'][:_SOURCE_MAX_CHARS - 2]}" for r in results[:_SOURCE_ITEMS]),
+        _SOURCES_BUDGET, per_item_max=_SOURCE_MAX_CHARS
+    ))
+
+class ThinkingTool:
+    """Extended reasoning with step-by-step thinking"""
+    
+    async def think(self, query: str, ollama_client) -> Result[str, str]:
+        """Generate deep thinking process with native thinking support"""
+        prompt = _THINK_TMPL.format(query=query)
         return await ollama_client.generate(prompt, enable_thinking=True)
 
 class SearchTool:
     """Search through context, knowledge and web (like OpenAI)"""
     
-    def __init__(self, enable_web_search: bool = False):
+    def __init__(
+        self,
+        enable_web_search: bool = False,
+        cache_size: int = 256,
+        web_cache_ttl: float = 3600.0
+    ):
         self.enable_web_search = enable_web_search
+        self.cache_size = cache_size
+        self.web_cache_ttl = web_cache_ttl
+        # (query, context version, web enabled) -> results, in LRU order
+        self._cache: OrderedDict = OrderedDict()
+        # normalized query -> (fetched at, web results), in insertion order
+        self._web_cache: OrderedDict = OrderedDict()
+        # Politeness cap on concurrent DuckDuckGo requests
+        self._web_limit = asyncio.Semaphore(8)
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    def set_web_enabled(self, enabled: bool) -> None:
+        """Toggle web search without discarding cached results"""
+        self.enable_web_search = enabled
     
     def search_context(self, query: str, context_bullets: List) -> List[Dict]:
         """Search in local context"""
-        query_words = set(query.lower().split())
+        # Stopwords dropped from the query never count as overlap with a bullet
+        words = tokenize(query)
+        query_words = (words - _STOPWORDS) or words
         results = []
         
         for bullet in context_bullets:
-            bullet_words = set(bullet.content.lower().split())
-            overlap = len(query_words.intersection(bullet_words))
+            # word_set is tokenized once at bullet creation
+            bullet_words = bullet.word_set or tokenize(bullet.content)
+            overlap = len(query_words & bullet_words)
             if overlap > 0:
                 results.append({
                     'content': bullet.content,
@@ -47,66 +150,197 @@ class SearchTool:
                     'source': 'context'
                 })
         
-        results.sort(key=lambda x: x['relevance'], reverse=True)
-        return results[:5]
+        return heapq.nlargest(5, results, key=_RELEVANCE)
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Shared keep-alive session, created on first web search"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=40, keepalive_timeout=30, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=10)
+            )
+        return self._session
+    
+    async def aclose(self) -> None:
+        """Close the shared web session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
     
     async def search_web(self, query: str) -> List[Dict]:
-        """Search web using DuckDuckGo (free alternative to OpenAI search)"""
+        """Search web using DuckDuckGo, reusing results fetched within the TTL"""
+        key = query.strip().lower()
+        now = time.monotonic()
+        entry = self._web_cache.get(key)
+        if entry is not None and now - entry[0] < self.web_cache_ttl:
+            return list(entry[1])
+        
+        async with self._web_limit:
+            results = await self._fetch_web(query)
+        if results is None:
+            return []
+        # Only successful responses are cached; errors retry on the next call
+        self._web_cache.pop(key, None)
+        self._web_cache[key] = (now, results)
+        if len(self._web_cache) > self.cache_size:
+            self._web_cache.popitem(last=False)
+        return list(results)
+    
+    async def _fetch_web(self, query: str) -> Optional[List[Dict]]:
+        """Query DuckDuckGo (free alternative to OpenAI search), None on error"""
         try:
-            async with aiohttp.ClientSession() as session:
-                url = f"https://api.duckduckgo.com/?q={query}&format=json&no_html=1&skip_disambig=1"
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        results = []
-                        
-                        if data.get('Abstract'):
+            session = self._get_session()
+            # aiohttp quotes the query (spaces, '&', '#', unicode)
+            params = {"q": query, **_DDG_PARAMS}
+            async with session.get(_DDG_URL, params=params) as resp:
+                if resp.status == 200:
+                    # Parse the body directly; DuckDuckGo serves JSON as application/x-javascript
+                    data = orjson.loads(await resp.read())
+                    results = []
+                    
+                    if data.get('Abstract'):
+                        results.append({
+                            'content': data['Abstract'],
+                            'url': data.get('AbstractURL', ''),
+                            'source': 'web',
+                            'relevance': 10
+                        })
+                    
+                    for topic in data.get('RelatedTopics', [])[:3]:
+                        if isinstance(topic, dict) and topic.get('Text'):
                             results.append({
-                                'content': data['Abstract'],
-                                'url': data.get('AbstractURL', ''),
+                                'content': topic['Text'],
+                                'url': topic.get('FirstURL', ''),
                                 'source': 'web',
-                                'relevance': 10
+                                'relevance': 5
                             })
-                        
-                        for topic in data.get('RelatedTopics', [])[:3]:
-                            if isinstance(topic, dict) and topic.get('Text'):
-                                results.append({
-                                    'content': topic['Text'],
-                                    'url': topic.get('FirstURL', ''),
-                                    'source': 'web',
-                                    'relevance': 5
-                                })
-                        
-                        return results
+                    
+                    return results
         except Exception:
             pass
-        return []
+        return None
     
-    async def search(self, query: str, context_bullets: List) -> List[Dict]:
+    async def search(
+        self,
+        query: str,
+        context_bullets: List,
+        context_version: Optional[int] = None
+    ) -> List[Dict]:
         """Unified search: context + web (like OpenAI)"""
+        # Cache only when context_version identifies the bullets searched
+        key = (query, context_version, self.enable_web_search)
+        if context_version is not None and key in self._cache:
+            self._cache.move_to_end(key)
+            return list(self._cache[key])
+        
         context_results = self.search_context(query, context_bullets)
         
         web_results = []
         if self.enable_web_search:
             web_results = await self.search_web(query)
         
-        all_results = context_results + web_results
-        all_results.sort(key=lambda x: x['relevance'], reverse=True)
-        return all_results[:5]
+        top = heapq.nlargest(5, context_results + web_results, key=_RELEVANCE)
+        
+        if context_version is not None:
+            self._cache[key] = top
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return list(top)
 
 class DeepResearchTool:
     """Multi-step research with synthesis (like OpenAI deep research)"""
     
-    def __init__(self, enable_web_search: bool = False):
+    def __init__(
+        self,
+        enable_web_search: bool = False,
+        answer_cache: Optional[EmbeddingCache] = None,
+        answer_ttl: float = 3600.0
+    ):
         self.enable_web_search = enable_web_search
+        # Semantic cache of finished reports, values are (created, report)
+        self.answer_cache = answer_cache
+        self.answer_ttl = answer_ttl
+        # One search tool (web session and caches) serves every research run
+        self.search_tool = SearchTool(enable_web_search=enable_web_search)
+    
+    def set_web_enabled(self, enabled: bool) -> None:
+        """Toggle web search for subsequent research"""
+        # Cached reports were built with the other sources
+        if enabled != self.enable_web_search and self.answer_cache is not None:
+            self.answer_cache.clear()
+        self.enable_web_search = enabled
+        self.search_tool.set_web_enabled(enabled)
+    
+    async def aclose(self) -> None:
+        """Close the search tool's web session"""
+        await self.search_tool.aclose()
     
-    async def research(self, topic: str, ollama_client, context_bullets: List) -> Result[str, str]:
-        """Conduct deep research with web search"""
+    async def research(
+        self,
+        topic: str,
+        ollama_client,
+        context_bullets: List,
+        on_chunk: Optional[Callable[[str], None]] = None,
+        fast_path: bool = True
+    ) -> Result[str, str]:
+        """Conduct deep research with web search, optionally streaming the report to on_chunk"""
+        # Trivial topics get the matching sources without any LLM call,
+        # unless there are none to show
+        if fast_path and _is_trivial_topic(topic):
+            quick = await self._quick_lookup(topic, context_bullets)
+            if quick is not None:
+                if on_chunk is not None:
+                    on_chunk(quick.value)
+                return quick
+        
+        # Similar topics researched recently skip the whole pipeline
+        topic_vec = None
+        if self.answer_cache is not None:
+            # Embedding is CPU-bound: keep it off the event loop
+            topic_vec = await asyncio.to_thread(self.answer_cache.embed, topic)
+            cached = self.answer_cache.lookup(topic_vec)
+            if cached is not None:
+                if time.monotonic() - cached[0] < self.answer_ttl:
+                    if on_chunk is not None:
+                        on_chunk(cached[1])
+                    return Success(cached[1])
+                # Expired: drop it so the fresh report below takes its place
+                self.answer_cache.evict(topic_vec)
+        
+        result = await self._research(topic, ollama_client, context_bullets, self.search_tool, on_chunk)
+        if self.answer_cache is not None and topic_vec is not None and result.is_ok:
+            self.answer_cache.insert(topic_vec, (time.monotonic(), result.value))
+        return result
+    
+    async def _quick_lookup(self, topic: str, context_bullets: List) -> Optional[Success[str]]:
+        """Search-only answer for topics too thin to research, None when nothing matches"""
+        existing = await self.search_tool.search(topic, context_bullets)
+        if not existing:
+            return None
+        output = ["🔍 Step 1: Searching knowledge sources..."]
+        output.append(f"   Found {len(existing)} relevant sources")
+        output.append("\n⚡ Topic too short for multi-step research, showing sources:\n")
+        output.extend(e['content'] for e in existing[:5])
+        return Success("\n".join(output))
+    
+    async def _research(
+        self,
+        topic: str,
+        ollama_client,
+        context_bullets: List,
+        search_tool: SearchTool,
+        on_chunk: Optional[Callable[[str], None]] = None
+    ) -> Result[str, str]:
         output = []
         
-        output.append("🔍 Step 1: Searching knowledge sources...")
-        search_tool = SearchTool(enable_web_search=self.enable_web_search)
-        existing = await search_tool.search(topic, context_bullets)
+        # Steps 1-2 are independent (the questions prompt does not use sources): run together
+        output.append("🔍 Step 1: Searching knowledge sources (in parallel with step 2)...")
+        questions_prompt = _QUESTIONS_TMPL.format(topic=topic)
+        
+        existing, questions_result = await asyncio.gather(
+            search_tool.search(topic, context_bullets),
+            ollama_client.generate(questions_prompt)
+        )
         
         if existing:
             output.append(f"   Found {len(existing)} relevant sources")
@@ -115,12 +349,7 @@ class DeepResearchTool:
                 output.append(f"   {i}. {source_type}: {result['content'][:80]}...")
         
         output.append("\n🤔 Step 2: Generating research questions...")
-        questions_prompt = f"""Research topic: {topic}
-
-Based on available information, generate 3 specific research questions to explore:"""
-        
-        questions_result = await ollama_client.generate(questions_prompt)
-        if isinstance(questions_result, Failure):
+        if not questions_result.is_ok:
             return Failure("\n".join(output) + f"\n\n❌ Error: {questions_result.error}")
         
         questions = [q.strip() for q in questions_result.value.split('\n')[:3] if q.strip()]
@@ -128,45 +357,65 @@ Based on available information, generate 3 specific research questions to explor
             output.append(f"   Q{i}: {q}")
         
         output.append("\n💡 Step 3: Researching answers...")
-        answers = []
-        for i, question in enumerate(questions, 1):
-            q_results = await search_tool.search(question, context_bullets)
-            context_info = "\n".join([r['content'][:150] for r in q_results[:2]])
+        
+        # Search each distinct question once, all in parallel
+        unique_questions = list(dict.fromkeys(questions))
+        search_results = dict(zip(unique_questions, await asyncio.gather(
+            *(search_tool.search(question, context_bullets) for question in unique_questions)
+        )))
+        
+        async def answer_one(question: str) -> Result[str, str]:
+            q_results = search_results[question]
+            context_info = _pack_answer_context(q_results)
             
-            answer_prompt = f"""Question: {question}
-
-Relevant information:
-{context_info}
-
-Provide detailed answer:"""
-            answer_result = await ollama_client.generate(answer_prompt)
-            if isinstance(answer_result, Success):
+            answer_prompt = _ANSWER_TMPL.format(question=question, context_info=context_info)
+            return await ollama_client.generate(answer_prompt)
+        
+        # Questions are independent: answer them concurrently (OLLAMA_NUM_PARALLEL).
+        # The task group cancels every answer together if one raises or we are cancelled.
+        async with asyncio.TaskGroup() as tg:
+            answer_tasks = [tg.create_task(answer_one(question)) for question in questions]
+        answers = []
+        for i, (question, task) in enumerate(zip(questions, answer_tasks), 1):
+            answer_result = task.result()
+            if answer_result.is_ok:
                 output.append(f"   ✓ Answered Q{i}")
                 answers.append(f"Q{i}: {question}\nA{i}: {answer_result.value}")
         
         output.append("\n📝 Step 4: Synthesizing comprehensive report...\n")
         
-        sources_text = "\n".join([f"- {e['content'][:200]}" for e in existing[:3]])
-        synthesis_prompt = f"""Research topic: {topic}
-
-Sources consulted:
-{sources_text}
-
-Research findings:
-{chr(10).join(answers)}
-
-Synthesize a comprehensive, well-structured report with:
-1. Executive summary
-2. Key findings
-3. Detailed analysis
-4. Conclusion
-
-Report:"""
+        sources_text = _pack_sources(existing)
+        findings_text = "\n".join(pack_within_budget(answers, _FINDINGS_BUDGET))
+        synthesis_prompt = _SYNTH_TMPL.format_map({
+            "topic": topic,
+            "sources_text": sources_text,
+            "findings_text": findings_text
+        })
         
-        synthesis_result = await ollama_client.generate(synthesis_prompt)
+        header = "\n".join(output) + "\n" + "="*60 + "\n"
+        if on_chunk is None:
+            synthesis_result = await ollama_client.generate(synthesis_prompt)
+        else:
+            # Show progress and the report as it is generated
+            on_chunk(header)
+            synthesis_result = await self._stream_synthesis(ollama_client, synthesis_prompt, on_chunk)
         
-        if isinstance(synthesis_result, Success):
-            final_output = "\n".join(output) + "\n" + "="*60 + "\n" + synthesis_result.value
-            return Success(final_output)
+        if synthesis_result.is_ok:
+            return Success(header + synthesis_result.value)
         else:
             return Failure("\n".join(output) + f"\n\n❌ Synthesis error: {synthesis_result.error}")
+    
+    async def _stream_synthesis(
+        self,
+        ollama_client,
+        prompt: str,
+        on_chunk: Callable[[str], None]
+    ) -> Result[str, str]:
+        """Stream report chunks to on_chunk, returning the full report"""
+        parts = []
+        async for result in ollama_client.generate_stream(prompt):
+            if not result.is_ok:
+                return Failure(result.error)
+            parts.append(result.value)
+            on_chunk(result.value)
+        return Success("".join(parts).strip())